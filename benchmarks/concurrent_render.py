@@ -0,0 +1,78 @@
+"""
+Stress test for rendering in parallel threads of one process.
+
+All jobs share one Typeface and one prepared image per config. Every output has to be byte for byte the same as
+the output of a sequential render, and the shared glyphs must be unchanged afterwards. Exits with 1 otherwise.
+
+    python benchmarks/concurrent_render.py ./projects/my_project/config.json --jobs 64 --threads 8
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from letterart import Config, Converter, Mode
+from letterart.image_loader import prepare_image
+from letterart.ttf_loader import Typeface
+
+
+def snapshot(typeface: Typeface) -> List[Tuple[str, str, str]]:
+    return [(glyph.name, glyph.path, glyph.viewbox_str) for glyph in typeface.alphabet.glyphs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="renders the configs concurrently and compares the outputs")
+    parser.add_argument("configs", nargs="+", help="json configs, the jobs cycle through them")
+    parser.add_argument("--jobs", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    configs = [Config(filename) for filename in args.configs]
+    typefaces: Dict[Tuple[str, bool], Typeface] = {}
+    images = {}
+    for config in configs:
+        font_path = os.path.join(config.project_dir, config.font)
+        key = (font_path, bool(config.font_axis))
+        if key not in typefaces:
+            typefaces[key] = Typeface.from_file(font_path, bool(config.font_axis))
+        image_path = os.path.join(config.project_dir, config.picture_name)
+        mode = 'L' if config.mode == Mode.grayscale else 'RGB'
+        images[(image_path, mode, config.image_size)] = prepare_image(image_path, mode, config.image_size,
+                                                                      config.max_image_memory_mb)
+
+    def render(config: Config) -> bytes:
+        font_path = os.path.join(config.project_dir, config.font)
+        image_path = os.path.join(config.project_dir, config.picture_name)
+        mode = 'L' if config.mode == Mode.grayscale else 'RGB'
+        converter = Converter(config, image=images[(image_path, mode, config.image_size)],
+                              typeface=typefaces[(font_path, bool(config.font_axis))])
+        return converter.to_bytes()
+
+    before = {key: snapshot(typeface) for key, typeface in typefaces.items()}
+    start = time.perf_counter()
+    expected = [render(config) for config in configs]
+    sequential_duration = time.perf_counter() - start
+
+    jobs = [idx % len(configs) for idx in range(args.jobs)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(lambda idx: render(configs[idx]), jobs))
+    duration = time.perf_counter() - start
+
+    mismatches = sum(result != expected[idx] for idx, result in zip(jobs, results))
+    changed = [key[0] for key, typeface in typefaces.items() if snapshot(typeface) != before[key]]
+
+    print(f"jobs:              {len(jobs)}")
+    print(f"threads:           {args.threads}")
+    print(f"sequential:        {sequential_duration / len(configs):.2f} s per job")
+    print(f"concurrent:        {duration:.2f} s, {len(jobs) / duration:.2f} jobs/s")
+    print(f"mismatches:        {mismatches}")
+    print(f"changed typefaces: {len(changed)}")
+    if mismatches or changed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
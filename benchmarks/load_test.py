@@ -0,0 +1,85 @@
+"""
+Load test for the local render service (letterart/server.py).
+
+Sends the same config payload from several concurrent clients and reports requests per second
+and latency percentiles.
+
+    python -m letterart.server --root ./projects/my_project --workers 4 &
+    python benchmarks/load_test.py ./projects/my_project/config.json --requests 200 --concurrency 8 --workers 4
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[idx]
+
+
+def run_client(host: str, port: int, body: bytes, num_requests: int) -> List[float]:
+    latencies = []
+    connection = http.client.HTTPConnection(host, port)
+    for _ in range(num_requests):
+        start = time.perf_counter()
+        connection.request("POST", "/render", body, {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"render failed with status {response.status}")
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="load test for the letterart render service")
+    parser.add_argument("config", help="json config that is sent as payload")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=100, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of render processes of the server, every one is warmed up")
+    parser.add_argument("--warmup", type=int, default=1,
+                        help="warm-up requests per worker (or per client, if there are more) sent before measuring")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as file:
+        body = json.dumps(json.load(file)).encode()
+
+    # every worker process has its own caches, so they are all warmed up with concurrent requests.
+    # otherwise the p99 latency mostly measures the first render of the workers that did not get a warm-up request
+    warmup_clients = max(args.concurrency, args.workers)
+    with ThreadPoolExecutor(max_workers=warmup_clients) as executor:
+        list(executor.map(run_client, [args.host] * warmup_clients, [args.port] * warmup_clients,
+                          [body] * warmup_clients, [args.warmup] * warmup_clients))
+
+    per_client = [args.requests // args.concurrency] * args.concurrency
+    for idx in range(args.requests % args.concurrency):
+        per_client[idx] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = executor.map(run_client, [args.host] * args.concurrency, [args.port] * args.concurrency,
+                               [body] * args.concurrency, per_client)
+        latencies = [latency for client_latencies in results for latency in client_latencies]
+    duration = time.perf_counter() - start
+
+    print(f"requests:     {len(latencies)}")
+    print(f"concurrency:  {args.concurrency}")
+    print(f"duration:     {duration:.2f} s")
+    print(f"requests/s:   {len(latencies) / duration:.2f}")
+    print(f"mean latency: {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"p50 latency:  {percentile(latencies, 0.50) * 1000:.1f} ms")
+    print(f"p99 latency:  {percentile(latencies, 0.99) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Checks the memory mapped reader of uncompressed tiled tiffs and raw images.
+
+Writes tiffs whose size is not a multiple of the tile size, so the edge tiles are only partly used, and compares
+load_image with the pixels that were written. Exits with 1 on a mismatch.
+
+    python benchmarks/tiled_tiff_check.py --tile 128
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+from typing import List, Tuple
+
+from PIL import Image, ImageChops
+
+from letterart.image_loader import RawImage, TiffSource, load_image
+
+PHOTOMETRIC = {"L": 1, "RGB": 2, "RGBA": 2}
+SHORT, LONG = 3, 4
+
+
+def write_tiled_tiff(filename: str, image: Image.Image, tile: int):
+    """
+    little endian uncompressed tiff, the edge tiles are padded to the full tile size like libtiff does
+    """
+    width, height = image.size
+    samples = len(image.getbands())
+    tiles = []
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            padded = Image.new(image.mode, (tile, tile))
+            padded.paste(image.crop((x, y, min(x + tile, width), min(y + tile, height))), (0, 0))
+            tiles.append(padded.tobytes())
+
+    data_offset = 8
+    offsets = [data_offset + idx * len(tiles[0]) for idx in range(len(tiles))]
+    entries: List[Tuple[int, int, list]] = [
+        (256, LONG, [width]), (257, LONG, [height]), (258, SHORT, [8] * samples), (259, SHORT, [1]),
+        (262, SHORT, [PHOTOMETRIC[image.mode]]), (277, SHORT, [samples]), (284, SHORT, [1]),
+        (322, SHORT, [tile]), (323, SHORT, [tile]), (324, LONG, offsets), (325, LONG, [len(data) for data in tiles])]
+    if image.mode == "RGBA":
+        entries.append((338, SHORT, [2]))
+
+    ifd_offset = data_offset + sum(len(data) for data in tiles)
+    extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack("<H", len(entries))
+    extra = b""
+    for tag, field_type, values in entries:
+        packed = struct.pack(f"<{len(values)}{'H' if field_type == SHORT else 'L'}", *values)
+        if len(packed) <= 4:
+            ifd += struct.pack("<HHL", tag, field_type, len(values)) + packed.ljust(4, b"\x00")
+        else:
+            ifd += struct.pack("<HHLL", tag, field_type, len(values), extra_offset + len(extra))
+            extra += packed
+    ifd += struct.pack("<L", 0)
+
+    with open(filename, 'wb') as file:
+        file.write(b"II*\x00" + struct.pack("<L", ifd_offset))
+        for data in tiles:
+            file.write(data)
+        file.write(ifd + extra)
+
+
+def random_image(mode: str, size: Tuple[int, int]) -> Image.Image:
+    return Image.frombytes(mode, size, os.urandom(size[0] * size[1] * len(Image.new(mode, (1, 1)).getbands())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="reads tiffs with partly used edge tiles and compares the pixels")
+    parser.add_argument("--tile", type=int, default=128)
+    parser.add_argument("--max-memory-mb", type=int, default=64)
+    args = parser.parse_args()
+
+    cases = [("L", (1000, 1000)), ("RGB", (1000, 1000)), ("RGBA", (1000, 1000)), ("L", (1001, 777)),
+             ("RGB", (257, 300)), ("L", (args.tile * 4, args.tile * 3))]
+    mismatches = 0
+    with tempfile.TemporaryDirectory() as directory:
+        for mode, size in cases:
+            image = random_image(mode, size)
+            filename = os.path.join(directory, f"{mode}_{size[0]}x{size[1]}.tif")
+            write_tiled_tiff(filename, image, args.tile)
+            source = TiffSource(filename)
+            assert source.tiled and source.raw_mode == mode
+            source.close()
+            result = load_image(filename, size, mode, args.max_memory_mb)
+            equal = ImageChops.difference(result, image).getbbox() is None
+            mismatches += not equal
+            print(f"tiled {mode} {size[0]}x{size[1]}: {'ok' if equal else 'MISMATCH'}")
+
+        image = random_image("L", (777, 999))
+        filename = os.path.join(directory, "image.raw")
+        with open(filename, 'wb') as file:
+            file.write(image.tobytes())
+        result = load_image(RawImage(filename, 777, 999, "L"), image.size, "L", args.max_memory_mb)
+        equal = ImageChops.difference(result, image).getbbox() is None
+        mismatches += not equal
+        print(f"raw L 777x999: {'ok' if equal else 'MISMATCH'}")
+
+    print(f"{mismatches} mismatches")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
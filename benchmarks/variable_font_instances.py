@@ -0,0 +1,49 @@
+"""
+Benchmark for instancing variable fonts (letterart.ttf_loader.VariableFont).
+
+Instances the font at N evenly spaced locations of one axis and then looks up the same locations again,
+which is what a fill mode render with font_axis does for every letter.
+
+    python benchmarks/variable_font_instances.py ./projects/my_project/font.ttf --axis wght --instances 5
+"""
+import argparse
+import time
+
+from letterart.ttf_loader import VariableFont
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark for variable font instancing")
+    parser.add_argument("font", help="variable ttf font")
+    parser.add_argument("--axis", default="wght")
+    parser.add_argument("--instances", type=int, default=5, help="number of distinct axis locations")
+    parser.add_argument("--lookups", type=int, default=10000, help="number of cached lookups")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    font = VariableFont(args.font, flip_horizontally=True)
+    load_duration = time.perf_counter() - start
+
+    minimum, _, maximum = font.axes[args.axis]
+    steps = max(2, args.instances)
+    values = [minimum + (maximum - minimum) * idx / (steps - 1) for idx in range(steps)]
+
+    start = time.perf_counter()
+    for value in values:
+        font.typeface({args.axis: value})
+    instance_duration = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for idx in range(args.lookups):
+        font.typeface({args.axis: values[idx % steps]})
+    lookup_duration = time.perf_counter() - start
+
+    print(f"load font:        {load_duration * 1000:.1f} ms")
+    print(f"instances:        {steps}")
+    print(f"per instance:     {instance_duration / steps * 1000:.1f} ms")
+    print(f"cached lookups:   {args.lookups}")
+    print(f"per lookup:       {lookup_duration / args.lookups * 1e6:.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,5 @@
 from .svg_constructor import Converter, Config, Mode
-from .ttf_loader import extract_alphabet
\ No newline at end of file
+from .ttf_loader import extract_alphabet, Typeface
+from .progress import Progress, RenderCancelled
+from .pdf_writer import PdfWriter
+from .specimen import Specimen
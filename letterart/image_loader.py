@@ -0,0 +1,324 @@
+"""
+Reading of huge images with bounded memory.
+
+Tiled and striped tiffs and headerless raw pixel data are memory mapped and reduced tile by tile to the target
+resolution, so only a few tiles and the (small) result have to fit into memory. Jpegs are decoded at a reduced
+scale. Everything else is loaded completely, as long as it fits into the memory budget.
+"""
+from __future__ import annotations
+import io
+import math
+import mmap
+import struct
+from typing import Optional, Tuple, List, Iterator, Callable, Union
+from PIL import Image, TiffImagePlugin
+
+DEFAULT_MAX_MEMORY_MB = 256
+
+# pillow keeps every pixel in 4 bytes, decoding a tile also needs the encoded data and a converted copy
+DECODED_BYTES_PER_PIXEL = 12
+
+# bytes per pixel of the 8 bit modes that can be read straight from the memory map
+RAW_MODES = {"L": 1, "RGB": 3, "RGBA": 4, "CMYK": 4}
+
+# tags that describe how the pixels of a tiff are encoded, they are copied into the single tile tiffs
+TIFF_ENCODING_TAGS = (258, 259, 262, 277, 284, 317, 338, 339, 347, 530, 532)
+IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC = 256, 257, 258, 259, 262
+STRIP_OFFSETS, SAMPLES_PER_PIXEL, ROWS_PER_STRIP, STRIP_BYTE_COUNTS, PLANAR_CONFIGURATION = 273, 277, 278, 279, 284
+TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS, EXTRA_SAMPLES = 322, 323, 324, 325, 338
+
+# one row of tiles: y coordinate, height and a list of x coordinates with a function that decodes the tile
+TileRow = Tuple[int, int, List[Tuple[int, Callable[[], Image.Image]]]]
+
+
+class RawImage:
+    """
+    headerless 8 bit pixel data stored row by row, e.g. written with numpy.ndarray.tofile
+    """
+
+    def __init__(self, filename: str, width: int, height: int, mode: str = "RGB", offset: int = 0):
+        if mode not in RAW_MODES:
+            raise ValueError(f"raw images must have one of the modes {', '.join(RAW_MODES)}")
+        self.filename = filename
+        self.size = (width, height)
+        self.mode = mode
+        self.offset = offset
+
+
+class MappedSource:
+    """
+    memory mapped image that is decoded tile by tile
+    """
+
+    def __init__(self, filename: str):
+        self.file = open(filename, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = (0, 0)
+        self.tile_size = (0, 0)
+        self.tiled = False
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def read(self, offset: int, length: int) -> bytes:
+        """
+        copies the bytes out of the memory map and drops the mapped pages again, so that they don't add up
+        in the resident memory of the process
+        """
+        data = self.mm[offset:offset + length]
+        if hasattr(mmap, "MADV_DONTNEED"):
+            start = offset - offset % mmap.PAGESIZE
+            self.mm.madvise(mmap.MADV_DONTNEED, start, min(offset + length, len(self.mm)) - start)
+        return data
+
+    def raw_window(self, mode: str, offset: int, stride: int, width: int, height: int) -> Image.Image:
+        """
+        image of width x height pixels that start at offset, rows are stride bytes apart
+        """
+        # frombuffer needs the full stride also of the last row, which can go past the end of the map
+        data = self.read(offset, height * stride)
+        if len(data) < height * stride:
+            data += bytes(height * stride - len(data))
+        return Image.frombuffer(mode, (width, height), data, "raw", mode, stride, 1)
+
+    def raw_bands(self, mode: str, regions: List[Tuple[int, int, int]], max_bytes: int) -> Iterator[TileRow]:
+        """
+        splits regions of full width rows (y, height, offset) into bands that fit into max_bytes
+        """
+        width = self.size[0]
+        stride = width * RAW_MODES[mode]
+        if width * DECODED_BYTES_PER_PIXEL > max_bytes:
+            raise ValueError("a single row of the image does not fit into the memory limit")
+        rows_per_band = max_bytes // (width * DECODED_BYTES_PER_PIXEL)
+        for region_y, region_height, region_offset in regions:
+            for y in range(0, region_height, rows_per_band):
+                height = min(rows_per_band, region_height - y)
+                offset = region_offset + y * stride
+                yield region_y + y, height, [(0, lambda offset=offset, height=height:
+                                              self.raw_window(mode, offset, stride, width, height))]
+
+    def estimated_tile_bytes(self) -> int:
+        """
+        memory needed to decode one tile, 0 if the image can be cut into bands of any height
+        """
+        return self.tile_size[0] * self.tile_size[1] * DECODED_BYTES_PER_PIXEL
+
+
+class RawSource(MappedSource):
+    def __init__(self, raw_image: RawImage):
+        super().__init__(raw_image.filename)
+        self.raw_image = raw_image
+        self.size = raw_image.size
+        self.tile_size = (raw_image.size[0], 1)
+
+    def estimated_tile_bytes(self) -> int:
+        return 0
+
+    def iter_tile_rows(self, max_bytes: int) -> Iterator[TileRow]:
+        return self.raw_bands(self.raw_image.mode, [(0, self.size[1], self.raw_image.offset)], max_bytes)
+
+
+class TiffSource(MappedSource):
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        big_tiff = self.mm[2:4] in (b"+\x00", b"\x00+")
+        self.ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=self.mm[:16] if big_tiff else self.mm[:8])
+        # the single tile tiffs are always classic tiffs with the same byte order
+        byte_order = "<" if self.mm[:2] == b"II" else ">"
+        self.ifh = self.mm[:2] + struct.pack(f"{byte_order}HL", 42, 8)
+        self.file.seek(self.ifd.next)
+        self.ifd.load(self.file)
+        self.size = (self.ifd[IMAGE_WIDTH], self.ifd[IMAGE_LENGTH])
+        if self.ifd.get(PLANAR_CONFIGURATION, 1) != 1:
+            raise ValueError("tiffs with separate color planes are not supported")
+
+        self.tiled = TILE_OFFSETS in self.ifd
+        if self.tiled:
+            self.tile_size = (self.ifd[TILE_WIDTH], self.ifd[TILE_LENGTH])
+            self.offsets, self.byte_counts = self.ifd[TILE_OFFSETS], self.ifd[TILE_BYTE_COUNTS]
+        else:
+            self.tile_size = (self.size[0], min(self.ifd.get(ROWS_PER_STRIP, self.size[1]), self.size[1]))
+            self.offsets, self.byte_counts = self.ifd[STRIP_OFFSETS], self.ifd[STRIP_BYTE_COUNTS]
+        self.raw_mode = self.get_raw_mode()
+
+    def get_raw_mode(self) -> Optional[str]:
+        """
+        mode of uncompressed 8 bit data that can be read straight from the memory map, None otherwise
+        """
+        if self.ifd.get(COMPRESSION, 1) != 1 or any(bits != 8 for bits in self.ifd.get(BITS_PER_SAMPLE, (1,))):
+            return None
+        photometric = self.ifd.get(PHOTOMETRIC)
+        samples = self.ifd.get(SAMPLES_PER_PIXEL, 1)
+        if photometric == 1 and samples == 1:
+            return "L"
+        if photometric == 2 and samples == 3:
+            return "RGB"
+        if photometric == 2 and samples == 4 and self.ifd.get(EXTRA_SAMPLES) in ((1,), (2,)):
+            return "RGBA"
+        if photometric == 5 and samples == 4:
+            return "CMYK"
+        return None
+
+    def estimated_tile_bytes(self) -> int:
+        if self.raw_mode is not None and not self.tiled:
+            return 0
+        return super().estimated_tile_bytes()
+
+    def single_tile_tiff(self, idx: int, width: int, height: int) -> Image.Image:
+        """
+        wraps the encoded data of one tile or strip into a tiff of its own, so that only this part is decoded
+        """
+        ifd = TiffImagePlugin.ImageFileDirectory_v2(ifh=self.ifh)
+        for tag in TIFF_ENCODING_TAGS:
+            if tag in self.ifd:
+                ifd.tagtype[tag] = self.ifd.tagtype[tag]
+                ifd[tag] = self.ifd[tag]
+        ifd[IMAGE_WIDTH] = width
+        ifd[IMAGE_LENGTH] = height
+        ifd[ROWS_PER_STRIP] = height
+        ifd[STRIP_BYTE_COUNTS] = (self.byte_counts[idx],)
+        # tobytes moves the strip offset behind the directory, which is where the data is appended
+        ifd[STRIP_OFFSETS] = (0,)
+        data = self.read(self.offsets[idx], self.byte_counts[idx])
+        image = Image.open(io.BytesIO(self.ifh + ifd.tobytes(8) + data))
+        image.load()
+        return image
+
+    def load_tile(self, idx: int, width: int, height: int) -> Image.Image:
+        tile_width, tile_height = self.tile_size
+        if self.raw_mode is not None:
+            stride = tile_width * RAW_MODES[self.raw_mode]
+            return self.raw_window(self.raw_mode, self.offsets[idx], stride, width, height)
+        # tiles are always stored with the full tile size, only the last strip is shorter
+        image = self.single_tile_tiff(idx, tile_width, tile_height if self.tiled else height)
+        if image.size != (width, height):
+            image = image.crop((0, 0, width, height))
+        return image
+
+    def iter_tile_rows(self, max_bytes: int) -> Iterator[TileRow]:
+        width, height = self.size
+        tile_width, tile_height = self.tile_size
+        if self.raw_mode is not None and not self.tiled:
+            # uncompressed strips can be cut anywhere, neighbouring strips are merged into one region
+            regions = []
+            for idx, offset in enumerate(self.offsets):
+                y = idx * tile_height
+                rows = min(tile_height, height - y)
+                previous = regions[-1] if regions else None
+                if previous is not None and previous[2] + previous[1] * width * RAW_MODES[self.raw_mode] == offset:
+                    regions[-1] = (previous[0], previous[1] + rows, previous[2])
+                else:
+                    regions.append((y, rows, offset))
+            yield from self.raw_bands(self.raw_mode, regions, max_bytes)
+            return
+
+        tiles_across = math.ceil(width / tile_width)
+        for row, y in enumerate(range(0, height, tile_height)):
+            rows = min(tile_height, height - y)
+            tiles = []
+            for column, x in enumerate(range(0, width, tile_width)):
+                idx = row * tiles_across + column
+                tiles.append((x, lambda idx=idx, columns=min(tile_width, width - x), rows=rows:
+                              self.load_tile(idx, columns, rows)))
+            yield y, rows, tiles
+
+
+def reduction_factor(source: MappedSource, size: Tuple[int, int]) -> int:
+    """
+    largest integer factor the source can be reduced by tile by tile without getting smaller than size,
+    for tiled images it has to divide the tile width, so that the reduced tiles fit together
+    """
+    ratio = min(source.size[0] / size[0], source.size[1] / size[1])
+    factor = max(1, math.floor(ratio))
+    if source.tiled:
+        while source.tile_size[0] % factor != 0:
+            factor -= 1
+    return factor
+
+
+def downsample(source: MappedSource, size: Tuple[int, int], mode: str, max_bytes: int) -> Image.Image:
+    """
+    reduces the source by an integer factor tile by tile (box filter) and resizes the small result to size
+    """
+    factor = reduction_factor(source, size)
+    reduced_width = math.ceil(source.size[0] / factor)
+    reduced_height = math.ceil(source.size[1] / factor)
+
+    reduced_bytes = reduced_width * reduced_height * 4
+    tile_bytes = source.estimated_tile_bytes()
+    band_bytes = reduced_width * (source.tile_size[1] + factor) * 4 * 2 if tile_bytes else 0
+    fixed_bytes = reduced_bytes + tile_bytes + band_bytes
+    if fixed_bytes >= max_bytes:
+        raise ValueError(f"reading the image needs about {fixed_bytes // 2 ** 20 + 1} MB, "
+                         f"which exceeds the memory limit of {max_bytes // 2 ** 20} MB")
+
+    reduced = Image.new(mode, (reduced_width, reduced_height))
+    pending = None
+    reduced_y = 0
+    for y, height, tiles in source.iter_tile_rows(max_bytes - fixed_bytes):
+        band = Image.new(mode, (reduced_width, height))
+        for x, load_tile in tiles:
+            tile = load_tile()
+            if tile.mode != mode:
+                tile = tile.convert(mode)
+            if factor > 1:
+                tile = tile.reduce((factor, 1))
+            band.paste(tile, (x // factor, 0))
+            del tile
+
+        if pending is not None:
+            merged = Image.new(mode, (reduced_width, pending.height + band.height))
+            merged.paste(pending, (0, 0))
+            merged.paste(band, (0, pending.height))
+            band = merged
+
+        full_rows = band.height // factor * factor
+        if full_rows:
+            reduced.paste(band.crop((0, 0, reduced_width, full_rows)).reduce((1, factor)), (0, reduced_y))
+            reduced_y += full_rows // factor
+        pending = band.crop((0, full_rows, reduced_width, band.height)) if full_rows < band.height else None
+
+    if pending is not None:
+        reduced.paste(pending.reduce((1, factor)), (0, reduced_y))
+    return reduced.resize(size)
+
+
+def is_tiff(filename: str) -> bool:
+    with open(filename, 'rb') as file:
+        return file.read(4) in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+def load_image(image: Union[str, RawImage], size: Tuple[int, int], mode: str,
+               max_memory_mb: int = DEFAULT_MAX_MEMORY_MB) -> Image.Image:
+    """
+    returns the image converted to mode and resized to size, without using much more than max_memory_mb
+    (plus the memory mapped pages, which the os can drop at any time)
+    """
+    max_bytes = max_memory_mb * 2 ** 20
+    if isinstance(image, RawImage) or is_tiff(image):
+        source = RawSource(image) if isinstance(image, RawImage) else TiffSource(image)
+        try:
+            return downsample(source, size, mode, max_bytes)
+        finally:
+            source.close()
+
+    opened = Image.open(image)
+    if opened.format == "JPEG":
+        # the jpeg decoder can scale down by up to 8 while decoding
+        opened.draft(mode, size)
+    needed_bytes = opened.size[0] * opened.size[1] * len(opened.getbands()) * 2
+    if needed_bytes >= max_bytes:
+        raise ValueError(f"{image} needs about {needed_bytes // 2 ** 20 + 1} MB to be read, which exceeds the "
+                         f"memory limit of {max_memory_mb} MB. convert it to a tiled tiff to read it in parts")
+    return opened.convert(mode).resize(size)
+
+
+def prepare_image(image_path: str, mode: str, size: Tuple[int, int], max_memory_mb: int = 0) -> Image.Image:
+    """
+    without a memory limit the whole image is loaded before it is resized
+    """
+    if max_memory_mb:
+        return load_image(image_path, size, mode, max_memory_mb)
+    image = Image.open(image_path)
+    return image.convert(mode).resize(size)
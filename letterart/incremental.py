@@ -0,0 +1,148 @@
+from typing import Optional, List
+from lxml import etree
+from .svg_constructor import Converter, Mode, MASK_ATTRIBS
+
+
+class LayoutLine:
+    def __init__(self, words_list: list, start_idx: int, number_words: int, new_backspace: int, loc_y: int,
+                 elements: List[etree.Element]):
+        self.start_idx = start_idx
+        self.number_words = number_words
+        self.new_backspace = new_backspace
+        self.loc_y = loc_y
+        self.elements = elements
+        # get_idx_and_space_size looks at the words of the line plus the one that did not fit anymore,
+        # or at all remaining words of the doubled words list if the line never overflowed
+        num_examined = min(number_words + 1, 2 * len(words_list) - start_idx)
+        self.examined_words = [words_list[(start_idx + idx) % len(words_list)] for idx in range(num_examined)]
+        self.reached_end = start_idx + num_examined == 2 * len(words_list)
+
+    def matches(self, words_list: list, start_idx: int) -> bool:
+        """
+        True if laying out words_list from start_idx would result in exactly this line
+        """
+        num_words = len(words_list)
+        num_examined = len(self.examined_words)
+        if start_idx + num_examined > 2 * num_words:
+            return False
+        if (start_idx + num_examined == 2 * num_words) != self.reached_end:
+            return False
+        for idx, word in enumerate(self.examined_words):
+            if words_list[(start_idx + idx) % num_words] != word:
+                return False
+        return True
+
+    def to_string(self) -> str:
+        return "".join(etree.tostring(element, encoding="unicode") for element in self.elements)
+
+
+class IncrementalLayout:
+    """
+    keeps the layout of the previous render and only lays out the lines again that are affected by a text change.
+    the line breaks only depend on the words from the start index of a line onwards, so every line is reused
+    as soon as the words it looks at are the same as before, also behind an edit once the word alignment matches again
+
+        layout = IncrementalLayout(Converter(config))
+        svg = layout.render(text)
+        svg = layout.render(edited_text)  # patches svg in place, see layout.changed_lines
+
+    with merge_mask_paths "page" the lines are kept as separate paths outside of the svg and joined into the
+    single mask path after every render
+    """
+
+    def __init__(self, converter: Converter):
+        self.converter = converter
+        self.lines: List[LayoutLine] = []
+        self.changed_lines: List[int] = []
+        self.container: Optional[etree.Element] = None
+        self.attribs: Optional[dict] = None
+        self.page_path: Optional[etree.Element] = None
+
+    def create_structure(self):
+        converter = self.converter
+        if converter.config.mode == Mode.fill:
+            self.container = converter.svg_file
+        else:
+            defs = etree.SubElement(converter.svg_file, "defs")
+            self.container = etree.SubElement(defs, "mask", {"id": "mask1"})
+            self.attribs = MASK_ATTRIBS
+            if converter.config.merge_mask_paths == "page":
+                self.page_path = etree.SubElement(self.container, "path", {"d": ""})
+                self.page_path.attrib.update(MASK_ATTRIBS)
+            converter.add_foreground()
+            if converter.config.mode == Mode.color:
+                converter.add_background()
+            else:
+                converter.add_grayscale_background()
+
+    def render(self, text: Optional[str] = None) -> etree.Element:
+        """
+        lays out text (or the text of the converter) and returns the svg element of the converter
+        """
+        converter = self.converter
+        if text is not None:
+            converter.text_as_str = text.replace('\n', ' ')
+        if self.container is None:
+            self.create_structure()
+
+        words_list = converter.get_words()
+        try:
+            new_lines = []
+            self.changed_lines = []
+            previous_element = None
+            loc_y = converter.config.min_y
+            start_idx = 0
+            row = 0
+            while loc_y < converter.config.max_y:
+                old_line = self.lines[row] if row < len(self.lines) else None
+                if old_line is not None and old_line.matches(words_list, start_idx):
+                    line = old_line
+                    line.start_idx = start_idx
+                else:
+                    number_words, new_backspace = converter.get_idx_and_space_size(words_list, start_idx)
+                    elements = converter.line_elements(words_list, start_idx, number_words, new_backspace, loc_y,
+                                                       self.attribs)
+                    line = LayoutLine(words_list, start_idx, number_words, new_backspace, loc_y, elements)
+                    if self.page_path is None:
+                        if old_line is not None:
+                            for element in old_line.elements:
+                                self.container.remove(element)
+                        self.insert_after(previous_element, elements)
+                    self.changed_lines.append(row)
+
+                if line.elements:
+                    previous_element = line.elements[-1]
+                new_lines.append(line)
+                start_idx = (start_idx + line.number_words) % (len(words_list) - 1)
+                loc_y += converter.config.space_y
+                row += 1
+        finally:
+            # the memory mapped text of stream_text is not needed anymore, the lines keep their words as strings
+            converter.close_words()
+
+        self.lines = new_lines
+        if self.page_path is not None:
+            # every line path starts with an absolute moveto, so they can simply be joined
+            self.page_path.set("d", "".join(element.get("d") for line in self.lines for element in line.elements))
+        if converter.config.mode == Mode.fill and converter.config.style_buckets > 0:
+            # new lines can bring new styles, grouping by style would break the line order, so classes are used
+            converter.add_style_classes()
+        return converter.svg_file
+
+    def insert_after(self, previous_element: Optional[etree.Element], elements: List[etree.Element]):
+        if previous_element is None:
+            for idx, element in enumerate(elements):
+                self.container.insert(idx, element)
+            return
+        for element in elements:
+            previous_element.addnext(element)
+            previous_element = element
+
+    def changed_fragments(self) -> List[str]:
+        """
+        returns the svg code of every line that changed during the last render
+        """
+        return [self.lines[row].to_string() for row in self.changed_lines]
+
+    def to_bytes(self) -> bytes:
+        return etree.tostring(self.converter.svg_file, pretty_print=True, xml_declaration=True, encoding="utf-8")
@@ -0,0 +1,330 @@
+"""
+Streaming pdf backend.
+
+Every distinct glyph is written once as a Form XObject and each letter only places it with a translation
+matrix, stroke width and colors are set per placement. The content stream is compressed while the lines are
+laid out, so the memory does not grow with the number of letters.
+
+    PdfWriter(Converter(config)).save("its_art_now.pdf")
+
+In the color and grayscale modes the letters are drawn into a luminosity soft mask of the background image,
+like the mask of the svg output.
+"""
+import os
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .svg_constructor import Converter, Mode, MASK_ATTRIBS, partial_file
+from .ttf_loader import Glyph, SVGCommands, format_number
+
+POINTS_PER_MM = 72 / 25.4
+NAMED_COLORS = {"black": (0, 0, 0), "white": (255, 255, 255)}
+# compressed content is written to the file in chunks of this size
+FLUSH_SIZE = 1 << 16
+
+
+def parse_color(color: str) -> Optional[Tuple[int, int, int]]:
+    """
+    rgb tuple of a svg color (black, white, #rgb or #rrggbb), None for "none"
+    """
+    if color == "none":
+        return None
+    if color in NAMED_COLORS:
+        return NAMED_COLORS[color]
+    if color.startswith("#") and len(color) == 4:
+        return tuple(int(channel * 2, 16) for channel in color[1:])
+    if color.startswith("#") and len(color) == 7:
+        return tuple(int(color[idx:idx + 2], 16) for idx in (1, 3, 5))
+    raise ValueError(f"color {color} is not supported by the pdf writer, use black, white or #rrggbb")
+
+
+def color_operator(color: Tuple[int, int, int], stroking: bool) -> str:
+    if color[0] == color[1] == color[2]:
+        return f"{format_number(color[0] / 255)} {'G' if stroking else 'g'}"
+    channels = " ".join(format_number(channel / 255) for channel in color)
+    return f"{channels} {'RG' if stroking else 'rg'}"
+
+
+def glyph_operators(letter: Glyph) -> Tuple[str, List[float]]:
+    """
+    pdf path operators of the glyph at its unmoved position and the bounding box of all points.
+    quadratic curves are converted to cubic ones, pdf has no quadratic curves
+    """
+    contour = letter.contours[0]
+    operators = []
+    x = y = start_x = start_y = 0
+    xs, ys = [], []
+    for idx, instruction in enumerate(contour.svg_instructions):
+        command = instruction.command
+        coordinates = instruction.coordinates
+        if idx == 0:
+            # the first moveto is the only absolute point that is changed by move_to
+            coordinates = [contour.initial_mx, contour.initial_my]
+        if command == SVGCommands.Z:
+            operators.append("h")
+            x, y = start_x, start_y
+            continue
+        if command.value.islower():
+            points = [(x + coordinates[i], y + coordinates[i + 1]) for i in range(0, len(coordinates), 2)]
+        else:
+            points = [(coordinates[i], coordinates[i + 1]) for i in range(0, len(coordinates), 2)]
+
+        if command in (SVGCommands.M, SVGCommands.m):
+            start_x, start_y = points[0]
+            operators.append(f"{format_number(points[0][0])} {format_number(points[0][1])} m")
+        elif command in (SVGCommands.L, SVGCommands.l):
+            operators.append(f"{format_number(points[0][0])} {format_number(points[0][1])} l")
+        else:
+            (control_x, control_y), (end_x, end_y) = points
+            first = (x + 2 / 3 * (control_x - x), y + 2 / 3 * (control_y - y))
+            second = (end_x + 2 / 3 * (control_x - end_x), end_y + 2 / 3 * (control_y - end_y))
+            operators.append(" ".join(format_number(value) for value in (*first, *second, end_x, end_y)) + " c")
+        x, y = points[-1]
+        xs.extend(point[0] for point in points)
+        ys.extend(point[1] for point in points)
+    return "\n".join(operators), [min(xs), min(ys), max(xs), max(ys)]
+
+
+class PdfWriter:
+    def __init__(self, converter: Converter):
+        self.converter = converter
+        self.config = converter.config
+        self.file = None
+        self.offsets: Dict[int, int] = {}
+        self.next_object = 1
+        # glyph key -> (object number, resource name, form object), the forms are written after the content
+        self.glyph_forms: Dict[tuple, Tuple[int, str, bytes]] = {}
+
+    def new_object(self) -> int:
+        number = self.next_object
+        self.next_object += 1
+        return number
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def write_object(self, number: int, body: bytes):
+        self.offsets[number] = self.file.tell()
+        self.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def write_stream_object(self, number: int, dictionary: str, data: bytes):
+        self.write_object(number, f"<< {dictionary} /Length {len(data)} >>\nstream\n".encode() + data
+                          + b"\nendstream")
+
+    @property
+    def width(self) -> int:
+        return self.config.picture_dimension_x_mm * self.config.svg_scaling
+
+    @property
+    def height(self) -> int:
+        return self.config.picture_dimension_y_mm * self.config.svg_scaling
+
+    def save(self, destination: Optional[str] = "export.pdf") -> str:
+        """
+        writes to a temporary file next to destination first, a cancelled or failed render removes it
+        """
+        if not destination.endswith('.pdf'):
+            destination += '.pdf'
+        destination = os.path.join(self.converter.project_dir, destination)
+        converter = self.converter
+        converter.start_progress()
+        try:
+            with partial_file(destination) as partial_destination:
+                with open(partial_destination, 'wb') as self.file:
+                    self.write_document()
+        finally:
+            self.file = None
+            converter.close_words()
+        converter.report_progress("done")
+        return destination
+
+    def write_document(self):
+        catalog, pages, page = self.new_object(), self.new_object(), self.new_object()
+        self.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+        page_width = format_number(self.config.picture_dimension_x_mm * POINTS_PER_MM)
+        page_height = format_number(self.config.picture_dimension_y_mm * POINTS_PER_MM)
+        scale = f"{POINTS_PER_MM / self.config.svg_scaling:.8f}"
+        # svg units with the y axis pointing down, like in the svg output
+        page_transform = f"{scale} 0 0 -{scale} 0 {page_height} cm\n"
+
+        if self.config.mode == Mode.fill:
+            contents, resources = self.write_letters(page_transform, fill_mode=True)
+        else:
+            mask, _ = self.write_letters("", fill_mode=False)
+            contents, resources = self.write_masked_background(page_transform, mask)
+
+        self.write_object(page, (f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {page_width} {page_height}] "
+                                 f"/Resources {resources} 0 R /Contents {contents} 0 R >>").encode())
+        self.write_object(pages, f"<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>".encode())
+        self.write_object(catalog, f"<< /Type /Catalog /Pages {pages} 0 R >>".encode())
+
+        xref_offset = self.file.tell()
+        entries = [b"0000000000 65535 f \n"]
+        entries.extend(f"{self.offsets[number]:010d} 00000 n \n".encode() for number in range(1, self.next_object))
+        self.write(f"xref\n0 {self.next_object}\n".encode() + b"".join(entries))
+        self.write(f"trailer\n<< /Size {self.next_object} /Root {catalog} 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n"
+                   .encode())
+
+    def write_letters(self, prefix: str, fill_mode: bool) -> Tuple[int, int]:
+        """
+        streams the placements of all letters into one compressed content stream and returns the object numbers
+        of the stream and its resources. in fill_mode the stream is the page content, otherwise the soft mask group
+        """
+        converter = self.converter
+        stream, length, resources = self.new_object(), self.new_object(), self.new_object()
+        if fill_mode:
+            self.offsets[stream] = self.file.tell()
+            self.write(f"{stream} 0 obj\n<< /Length {length} 0 R /Filter /FlateDecode >>\nstream\n".encode())
+        else:
+            self.offsets[stream] = self.file.tell()
+            self.write(f"{stream} 0 obj\n<< /Type /XObject /Subtype /Form /BBox [0 0 {self.width} {self.height}] "
+                       f"/Group << /S /Transparency /CS /DeviceGray >> /Resources {resources} 0 R "
+                       f"/Length {length} 0 R /Filter /FlateDecode >>\nstream\n".encode())
+
+        compressor = zlib.compressobj()
+        start = self.file.tell()
+        operators = [prefix]
+        if not fill_mode:
+            operators.append(f"{color_operator(parse_color(MASK_ATTRIBS['fill']), False)} "
+                             f"{color_operator(parse_color(MASK_ATTRIBS['stroke']), True)} "
+                             f"{MASK_ATTRIBS['stroke-width']} w\n")
+        state = {}
+        pending = 0
+
+        words_list = converter.get_words()
+        for start_idx, number_words, new_backspace, loc_y in converter.iter_lines(words_list):
+            for letter in converter.place_letters(words_list, start_idx, number_words, new_backspace, loc_y,
+                                                  fill_mode):
+                if fill_mode:
+                    converter.set_strokewidth_of(letter)
+                    operators.append(self.style_operators(letter, state))
+                name = self.glyph_form(letter, fill_mode)
+                operators.append(f"q 1 0 0 1 {letter.x_coord} {letter.y_coord} cm /{name} Do Q\n")
+            pending += sum(len(operator) for operator in operators)
+            if pending >= FLUSH_SIZE:
+                self.write(compressor.compress("".join(operators).encode()))
+                operators = []
+                pending = 0
+        self.write(compressor.compress("".join(operators).encode()) + compressor.flush())
+        stream_length = self.file.tell() - start
+        self.write(b"\nendstream\nendobj\n")
+        self.write_object(length, str(stream_length).encode())
+
+        for number, name, form in self.glyph_forms.values():
+            self.write_object(number, form)
+        forms = " ".join(f"/{name} {number} 0 R" for number, name, _ in self.glyph_forms.values())
+        self.write_object(resources, f"<< /XObject << {forms} >> >>".encode())
+        return stream, resources
+
+    def style_operators(self, letter: Glyph, state: dict) -> str:
+        """
+        sets stroke width and colors of the letter, only what changed since the previous letter
+        """
+        operators = []
+        if state.get("w") != letter.stroke_width:
+            state["w"] = letter.stroke_width
+            operators.append(f"{letter.stroke_width} w")
+        if state.get("stroke") != letter.stroke:
+            state["stroke"] = letter.stroke
+            operators.append(color_operator(parse_color(letter.stroke), True))
+        if state.get("fill") != letter.fill and letter.fill != "none":
+            state["fill"] = letter.fill
+            operators.append(color_operator(parse_color(letter.fill), False))
+        return " ".join(operators) + " " if operators else ""
+
+    def glyph_form(self, letter: Glyph, fill_mode: bool) -> str:
+        """
+        resource name of the Form XObject of the glyph, it is created when the glyph is placed the first time
+        """
+        paint = "B" if not fill_mode or letter.fill != "none" else "S"
+        if not self.config.font_axis:
+            key = (letter.name, paint)
+        else:
+            # glyphs of different font instances share the name
+            key = (letter.name, paint, letter.path[len(letter.contours[0].svg_instructions[0].text):])
+        form = self.glyph_forms.get(key)
+        if form is None:
+            path, bbox = glyph_operators(letter)
+            margin = max(self.config.max_stroke_width, int(MASK_ATTRIBS["stroke-width"]))
+            bbox = " ".join(format_number(value) for value in
+                            (bbox[0] - margin, bbox[1] - margin, bbox[2] + margin, bbox[3] + margin))
+            content = zlib.compress(f"{path} {paint}".encode())
+            body = (f"<< /Type /XObject /Subtype /Form /BBox [{bbox}] /Length {len(content)} /Filter /FlateDecode >>"
+                    f"\nstream\n").encode() + content + b"\nendstream"
+            form = (self.new_object(), f"G{len(self.glyph_forms)}", body)
+            self.glyph_forms[key] = form
+        return form[1]
+
+    def write_masked_background(self, page_transform: str, mask: int) -> Tuple[int, int]:
+        """
+        writes the page content (background color and the image masked by the letters) and returns the
+        object numbers of the content and the page resources
+        """
+        image_object, image_width, image_height = self.write_image()
+        graphics_state, resources, contents = self.new_object(), self.new_object(), self.new_object()
+        self.write_object(graphics_state, (f"<< /Type /ExtGState /SMask << /Type /Mask /S /Luminosity "
+                                           f"/G {mask} 0 R >> >>").encode())
+        self.write_object(resources, (f"<< /XObject << /Im0 {image_object} 0 R >> "
+                                      f"/ExtGState << /GS0 {graphics_state} 0 R >> >>").encode())
+
+        # the image keeps its aspect ratio and is centered, like an svg image with the default preserveAspectRatio
+        scale = min(self.width / image_width, self.height / image_height)
+        width, height = image_width * scale, image_height * scale
+        x, y = (self.width - width) / 2, (self.height - height) / 2
+        background = color_operator(parse_color(self.config.background_color), False)
+        content = (f"{page_transform}{background} 0 0 {self.width} {self.height} re f\n/GS0 gs\n"
+                   f"q {format_number(width)} 0 0 {format_number(-height)} {format_number(x)} "
+                   f"{format_number(y + height)} cm /Im0 Do Q\n")
+        self.write_stream_object(contents, "/Filter /FlateDecode", zlib.compress(content.encode()))
+        return contents, resources
+
+    def write_image(self) -> Tuple[int, int, int]:
+        """
+        writes the background image and returns its object number and size.
+        jpegs are copied into the pdf without decoding them, other images are compressed in bands of rows
+        """
+        converter = self.converter
+        number = self.new_object()
+        if self.config.mode == Mode.color:
+            image = Image.open(converter.image_path)
+            if image.format == "JPEG" and image.mode in ("RGB", "L"):
+                color_space = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+                self.offsets[number] = self.file.tell()
+                self.write((f"{number} 0 obj\n<< /Type /XObject /Subtype /Image /Width {image.width} "
+                            f"/Height {image.height} /ColorSpace {color_space} /BitsPerComponent 8 "
+                            f"/Filter /DCTDecode /Length {os.path.getsize(converter.image_path)} >>\nstream\n")
+                           .encode())
+                with open(converter.image_path, 'rb') as jpeg:
+                    while True:
+                        chunk = jpeg.read(FLUSH_SIZE)
+                        if not chunk:
+                            break
+                        self.write(chunk)
+                self.write(b"\nendstream\nendobj\n")
+                return number, image.width, image.height
+            if not self.config.max_image_memory_mb:
+                image = image.convert("RGB")
+            else:
+                image = converter.image.convert("RGB")
+        else:
+            image = converter.image.convert("L")
+
+        length = self.new_object()
+        color_space = "/DeviceRGB" if image.mode == "RGB" else "/DeviceGray"
+        self.offsets[number] = self.file.tell()
+        self.write((f"{number} 0 obj\n<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+                    f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode /Length {length} 0 R >>"
+                    f"\nstream\n").encode())
+        start = self.file.tell()
+        compressor = zlib.compressobj()
+        rows = max(1, FLUSH_SIZE // (image.width * len(image.getbands())))
+        for top in range(0, image.height, rows):
+            self.write(compressor.compress(image.crop((0, top, image.width, min(top + rows, image.height))).tobytes()))
+        self.write(compressor.flush())
+        stream_length = self.file.tell() - start
+        self.write(b"\nendstream\nendobj\n")
+        self.write_object(length, str(stream_length).encode())
+        return number, image.width, image.height
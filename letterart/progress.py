@@ -0,0 +1,45 @@
+"""
+Progress reporting and cooperative cancellation for long renders.
+
+The Converter calls its progress_callback with a Progress object after every laid out line and before and after
+writing the file. Calling Converter.cancel() (e.g. from the callback or another thread) or raising RenderCancelled
+in the callback stops the render at the next line, files that were written partially are removed.
+"""
+import time
+from typing import Optional
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class Progress:
+    def __init__(self, total_lines: int):
+        self.phase: str = "layout"
+        self.total_lines = total_lines
+        self.lines_done: int = 0
+        self.letters_placed: int = 0
+        self.start_time = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start_time
+
+    @property
+    def fraction(self) -> float:
+        if self.total_lines <= 0:
+            return 1.0
+        return min(1.0, self.lines_done / self.total_lines)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        estimated seconds until the layout is finished, None before the first line is done
+        """
+        if self.lines_done == 0:
+            return None
+        return self.elapsed / self.lines_done * max(0, self.total_lines - self.lines_done)
+
+    def __repr__(self):
+        return (f"Progress(phase={self.phase}, lines_done={self.lines_done}/{self.total_lines}, "
+                f"letters_placed={self.letters_placed})")
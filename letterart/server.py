@@ -0,0 +1,236 @@
+"""
+Long-running local render service.
+
+Accepts Config-shaped json payloads via HTTP (TCP or unix socket) and answers with the rendered svg.
+Typefaces (alphabets and variable font instances) and prepared images are kept in LRU caches inside the worker
+processes, so only the first request for a font or an image pays for extract_alphabet and image decoding.
+
+    python -m letterart.server --root ./projects/my_project --port 8765
+
+    curl -X POST --data @config.json http://127.0.0.1:8765/render > export.svg
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple, Callable
+
+from PIL import Image
+
+from .image_loader import prepare_image
+from .svg_constructor import Config, Converter, Mode
+from .ttf_loader import Typeface
+
+ALPHABET_CACHE_SIZE = 16
+IMAGE_CACHE_SIZE = 32
+CHUNK_SIZE = 64 * 1024
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 100
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error"}
+
+_cached_typeface: Optional[Callable[[str, float, bool], Typeface]] = None
+_cached_image: Optional[Callable[[str, float, Mode, Tuple[int, int], int], Image.Image]] = None
+
+
+class RenderError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+def init_worker(alphabet_cache_size: int = ALPHABET_CACHE_SIZE, image_cache_size: int = IMAGE_CACHE_SIZE):
+    """
+    creates the per process caches, the modification time is part of the key so changed files are reloaded
+    """
+    global _cached_typeface, _cached_image
+
+    @lru_cache(maxsize=alphabet_cache_size)
+    def cached_typeface(font_path: str, mtime: float, variable: bool) -> Typeface:
+        return Typeface.from_file(font_path, variable)
+
+    @lru_cache(maxsize=image_cache_size)
+    def cached_image(image_path: str, mtime: float, mode: Mode, size: Tuple[int, int],
+                     max_memory_mb: int) -> Image.Image:
+        return prepare_image(image_path, 'L' if mode == Mode.grayscale else 'RGB', size, max_memory_mb)
+
+    _cached_typeface = cached_typeface
+    _cached_image = cached_image
+
+
+def resolve_path(root_dir: str, filename: str) -> str:
+    """
+    joins filename to root_dir and makes sure the result does not leave root_dir
+    """
+    root_dir = os.path.realpath(root_dir)
+    path = os.path.realpath(os.path.join(root_dir, filename))
+    if os.path.commonpath([root_dir, path]) != root_dir:
+        raise RenderError(400, f"{filename} is outside of the project directory")
+    if not os.path.isfile(path):
+        raise RenderError(404, f"{filename} does not exist")
+    return path
+
+
+def render_payload(payload: dict, root_dir: str) -> bytes:
+    """
+    renders a Config-shaped json object to svg, runs inside a worker process
+    """
+    if _cached_typeface is None:
+        init_worker()
+
+    try:
+        config = Config.from_dict(payload, root_dir)
+    except (ValueError, TypeError) as error:
+        raise RenderError(400, str(error))
+    config.project_dir = root_dir
+
+    font_path = resolve_path(root_dir, config.font)
+    image_path = resolve_path(root_dir, config.picture_name)
+    resolve_path(root_dir, config.text_file_name)
+
+    image = _cached_image(image_path, os.path.getmtime(image_path), config.mode, config.image_size,
+                          config.max_image_memory_mb)
+    try:
+        # e.g. a font_axis for a font that is not variable or has no such axis
+        typeface = _cached_typeface(font_path, os.path.getmtime(font_path), bool(config.font_axis))
+        converter = Converter(config, image=image, typeface=typeface)
+    except ValueError as error:
+        raise RenderError(400, str(error))
+    # the grayscale background is not written, concurrent previews would overwrite each other's image
+    return converter.to_bytes(save_background=False)
+
+
+class RenderServer:
+    def __init__(self, root_dir: str, workers: Optional[int] = None,
+                 alphabet_cache_size: int = ALPHABET_CACHE_SIZE, image_cache_size: int = IMAGE_CACHE_SIZE):
+        self.root_dir = os.path.abspath(root_dir)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                            initargs=(alphabet_cache_size, image_cache_size))
+
+    async def render(self, payload: dict) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, render_payload, payload, self.root_dir)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self.handle_request(request_line, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line: bytes, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> bool:
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            await self.send(writer, 400, b"malformed request line", keep_alive=False)
+            return False
+
+        headers = {}
+        header_lines = 0
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # readline raises ValueError for lines longer than the stream limit
+                await self.send(writer, 400, b"header line too long", keep_alive=False)
+                return False
+            if line in (b"\r\n", b"\n", b""):
+                break
+            header_lines += 1
+            if header_lines > MAX_HEADERS:
+                await self.send(writer, 400, b"too many headers", keep_alive=False)
+                return False
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # without a valid length the end of the body is unknown, so the connection can't be reused
+            await self.send(writer, 400, b"invalid content-length", keep_alive=False)
+            return False
+        if content_length > MAX_BODY_SIZE:
+            await self.send(writer, 413, b"payload too large", keep_alive=False)
+            return False
+        body = await reader.readexactly(content_length) if content_length else b""
+
+        if target == "/health":
+            await self.send(writer, 200, b"ok", keep_alive=keep_alive)
+        elif target != "/render":
+            await self.send(writer, 404, b"unknown path", keep_alive=keep_alive)
+        elif method != "POST":
+            await self.send(writer, 405, b"use POST", keep_alive=keep_alive)
+        else:
+            try:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    raise RenderError(400, "payload must be a json object")
+                svg = await self.render(payload)
+            except json.JSONDecodeError as error:
+                await self.send(writer, 400, str(error).encode(), keep_alive=keep_alive)
+            except RenderError as error:
+                await self.send(writer, error.status, error.message.encode(), keep_alive=keep_alive)
+            except Exception as error:
+                await self.send(writer, 500, repr(error).encode(), keep_alive=keep_alive)
+            else:
+                await self.send(writer, 200, svg, content_type="image/svg+xml", keep_alive=keep_alive)
+        return keep_alive
+
+    async def send(self, writer: asyncio.StreamWriter, status: int, body: bytes,
+                   content_type: str = "text/plain; charset=utf-8", keep_alive: bool = True):
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1"))
+        for start in range(0, len(body), CHUNK_SIZE):
+            writer.write(body[start:start + CHUNK_SIZE])
+            await writer.drain()
+        await writer.drain()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, unix_socket: Optional[str] = None):
+        if unix_socket is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="local letterart render service")
+    parser.add_argument("--root", default=".", help="directory that contains images, texts and fonts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix-socket", default=None, help="listen on this unix socket instead of tcp")
+    parser.add_argument("--workers", type=int, default=None, help="number of render processes")
+    parser.add_argument("--alphabet-cache-size", type=int, default=ALPHABET_CACHE_SIZE)
+    parser.add_argument("--image-cache-size", type=int, default=IMAGE_CACHE_SIZE)
+    args = parser.parse_args(argv)
+
+    server = RenderServer(args.root, args.workers, args.alphabet_cache_size, args.image_cache_size)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix_socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
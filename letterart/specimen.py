@@ -0,0 +1,227 @@
+"""
+Paginated font specimen.
+
+Shows every glyph of a font with its name, code point and metrics (advance width, left side bearing and bounding
+box), to check a font before it is used for a picture. The outlines are read with fontTools directly instead of
+through an Alphabet, and the pages are written one by one. Only the glyphs of the current page are decoded,
+so the memory stays flat also for CJK fonts with tens of thousands of glyphs.
+
+    Specimen("./projects/my_project/font.ttf").save("specimen.svg")  # specimen_001.svg, specimen_002.svg, ...
+"""
+import math
+import os
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from fontTools.pens.boundsPen import ControlBoundsPen
+from fontTools.pens.svgPathPen import SVGPathPen
+from fontTools.pens.teePen import TeePen
+from fontTools.ttLib import TTFont
+from fontTools.ttLib.tables._g_l_y_f import Glyph as TTGlyph, GlyphCoordinates
+from lxml import etree
+
+from .svg_constructor import partial_file
+from .ttf_loader import format_number
+
+
+def quadratic_path_data(coordinates: GlyphCoordinates, end_points: List[int], flags) -> str:
+    """
+    svg path data of truetype contours, two off curve points in a row have an implied on curve point between them
+    """
+    # the flat array of the coordinates is much faster to read than the points of GlyphCoordinates
+    values = coordinates.array
+    texts = [str(int(value)) if value.is_integer() else format_number(value) for value in values]
+    parts = []
+    start_idx = 0
+    for end_idx in end_points:
+        points = [(texts[2 * idx], texts[2 * idx + 1], values[2 * idx], values[2 * idx + 1])
+                  for idx in range(start_idx, end_idx + 1)]
+        on_curve = [flag & 1 for flag in flags[start_idx:end_idx + 1]]
+        start_idx = end_idx + 1
+        if not points:
+            continue
+        first_on_curve = next((idx for idx, on in enumerate(on_curve) if on), None)
+        if first_on_curve is None:
+            # only off curve points, the contour starts between the last and the first one
+            (_, _, last_x, last_y), (_, _, x, y) = points[-1], points[0]
+            start = f"{format_number((last_x + x) / 2)} {format_number((last_y + y) / 2)}"
+            order = range(len(points))
+        else:
+            start = f"{points[first_on_curve][0]} {points[first_on_curve][1]}"
+            order = [(first_on_curve + idx) % len(points) for idx in range(1, len(points))]
+        parts.append(f"M{start}")
+        control = None
+        for idx in order:
+            text_x, text_y, x, y = points[idx]
+            if on_curve[idx]:
+                parts.append(f"L{text_x} {text_y}" if control is None
+                             else f"Q{control[0]} {control[1]} {text_x} {text_y}")
+                control = None
+            else:
+                if control is not None:
+                    parts.append(f"Q{control[0]} {control[1]} {format_number((control[2] + x) / 2)} "
+                                 f"{format_number((control[3] + y) / 2)}")
+                control = (text_x, text_y, x, y)
+        if control is not None:
+            parts.append(f"Q{control[0]} {control[1]} {start}")
+        parts.append("Z")
+    return "".join(parts)
+
+
+class GlyphMetrics:
+    def __init__(self, name: str, code_point: Optional[int], advance_width: int, left_side_bearing: int,
+                 bounds: Optional[Tuple[float, float, float, float]]):
+        self.name = name
+        self.code_point = code_point
+        self.advance_width = advance_width
+        self.left_side_bearing = left_side_bearing
+        self.bounds = bounds
+
+    @property
+    def labels(self) -> List[str]:
+        bounds = " ".join(map(format_number, self.bounds)) if self.bounds is not None else "empty"
+        return [self.name,
+                f"U+{self.code_point:04X}" if self.code_point is not None else "no code point",
+                f"adv {self.advance_width} lsb {self.left_side_bearing}",
+                f"bbox {bounds}"]
+
+
+class Specimen:
+    def __init__(self, font_path: str, columns: int = 10, rows: int = 12):
+        self.font_path = font_path
+        self.columns = columns
+        self.rows = rows
+        self.font = TTFont(font_path, lazy=True)
+        self.glyph_set = self.font.getGlyphSet()
+        self.glyph_order = self.font.getGlyphOrder()
+        self.units_per_em = self.font["head"].unitsPerEm
+        self.ascender = self.font["hhea"].ascent
+        self.descender = self.font["hhea"].descent
+        self.metrics = self.font["hmtx"]
+
+        self.code_points: Dict[str, int] = {}
+        # the lowest code point of a glyph is shown
+        for code_point, name in sorted(self.font.getBestCmap().items(), reverse=True):
+            self.code_points[name] = code_point
+
+        self.label_size = round(self.units_per_em * 0.07)
+        self.cell_width = round(self.units_per_em * 1.4)
+        self.cell_height = self.ascender - self.descender + 6 * self.label_size
+        self.header_height = 3 * self.label_size
+
+        # the compiled data of every glyph, to put back the decoded glyphs of a page, see release
+        self.glyph_data: Dict[str, bytes] = {}
+        if "glyf" in self.font:
+            self.glyph_data = {name: glyph.data for name, glyph in self.font["glyf"].glyphs.items()
+                               if hasattr(glyph, "data")}
+
+    @property
+    def glyphs_per_page(self) -> int:
+        return self.columns * self.rows
+
+    @property
+    def number_of_pages(self) -> int:
+        return math.ceil(len(self.glyph_order) / self.glyphs_per_page)
+
+    def outline_of(self, name: str) -> Tuple[str, GlyphMetrics]:
+        """
+        svg path data of the glyph in font units (y pointing up) and its metrics
+        """
+        advance_width, left_side_bearing = self.metrics[name]
+        if "glyf" in self.font:
+            # the outlines are written directly from the points, which is several times faster than the pen protocol
+            glyf = self.font["glyf"]
+            glyph = glyf[name]
+            if glyph.numberOfContours == 0:
+                return "", GlyphMetrics(name, self.code_points.get(name), advance_width, left_side_bearing, None)
+            coordinates, end_points, flags = glyph.getCoordinates(glyf)
+            bounds = (glyph.xMin, glyph.yMin, glyph.xMax, glyph.yMax)
+            return quadratic_path_data(coordinates, end_points, flags), GlyphMetrics(
+                name, self.code_points.get(name), advance_width, left_side_bearing, bounds)
+
+        path_pen = SVGPathPen(self.glyph_set, ntos=format_number)
+        bounds_pen = ControlBoundsPen(self.glyph_set)
+        self.glyph_set[name].draw(TeePen(path_pen, bounds_pen))
+        metrics = GlyphMetrics(name, self.code_points.get(name), advance_width, left_side_bearing, bounds_pen.bounds)
+        return path_pen.getCommands(), metrics
+
+    def page(self, page_idx: int) -> etree.Element:
+        """
+        svg of one page, the glyphs are placed with a transform, nothing of the font is changed
+        """
+        names = self.glyph_order[page_idx * self.glyphs_per_page:(page_idx + 1) * self.glyphs_per_page]
+        width = self.columns * self.cell_width
+        height = self.header_height + self.rows * self.cell_height
+        svg = etree.Element("svg", {"version": "1.0", "xmlns": "http://www.w3.org/2000/svg",
+                                    "width": "210mm", "height": f"{format_number(210 * height / width)}mm",
+                                    "viewBox": f"0 0 {width} {height}"})
+        # presentation attributes instead of css, so also renderers without css support draw the boxes empty
+        text_attribs = {"font-family": "sans-serif", "font-size": f"{self.label_size}px"}
+        header = etree.SubElement(svg, "text", {"x": "0", "y": str(2 * self.label_size), **text_attribs})
+        header.text = (f"{os.path.basename(self.font_path)}  page {page_idx + 1}/{self.number_of_pages}  "
+                       f"glyphs {page_idx * self.glyphs_per_page}-{page_idx * self.glyphs_per_page + len(names) - 1}"
+                       f" of {len(self.glyph_order)}  units per em {self.units_per_em}")
+
+        for idx, name in enumerate(names):
+            path_data, metrics = self.outline_of(name)
+            x = (idx % self.columns) * self.cell_width + (self.cell_width - self.units_per_em) // 2
+            baseline = self.header_height + (idx // self.columns) * self.cell_height + self.ascender
+            cell = etree.SubElement(svg, "g", {"transform": f"translate({x} {baseline})"})
+            etree.SubElement(cell, "rect", {"x": "0", "y": str(-self.ascender), "width": str(metrics.advance_width),
+                                            "height": str(self.ascender - self.descender), "fill": "none",
+                                            "stroke": "#bbbbbb", "stroke-width": "4"})
+            etree.SubElement(cell, "line", {"x1": "0", "y1": "0", "x2": str(metrics.advance_width), "y2": "0",
+                                            "stroke": "red", "stroke-width": "4"})
+            if path_data:
+                etree.SubElement(cell, "path", {"d": path_data, "transform": "scale(1 -1)"})
+            for line, label in enumerate(metrics.labels):
+                text = etree.SubElement(cell, "text", {"x": "0", "y": str(-self.descender + (line + 1.3)
+                                                                          * self.label_size), **text_attribs})
+                text.text = label
+        self.release(names)
+        return svg
+
+    def iter_pages(self) -> Iterator[etree.Element]:
+        for page_idx in range(self.number_of_pages):
+            yield self.page(page_idx)
+
+    def save(self, destination: Optional[str] = "specimen.svg") -> List[str]:
+        """
+        writes every page to its own file, the page number is appended to the file name
+        """
+        if destination.endswith('.svg'):
+            destination = destination[:-4]
+        digits = len(str(self.number_of_pages))
+        destinations = []
+        for page_idx, page in enumerate(self.iter_pages()):
+            page_destination = f"{destination}_{page_idx + 1:0{digits}d}.svg"
+            with partial_file(page_destination) as partial_destination:
+                etree.ElementTree(page).write(partial_destination, pretty_print=True, xml_declaration=True,
+                                              encoding="utf-8")
+            destinations.append(page_destination)
+        return destinations
+
+    def release(self, names: List[str]):
+        """
+        fontTools keeps every glyph it has decoded, the glyphs of a finished page (and their components)
+        are put back into their compact form
+        """
+        if "glyf" in self.font:
+            glyf = self.font["glyf"]
+            decoded: Set[str] = set()
+            pending = list(names)
+            while pending:
+                name = pending.pop()
+                glyph = glyf.glyphs[name]
+                if name in decoded or hasattr(glyph, "data") or name not in self.glyph_data:
+                    continue
+                decoded.add(name)
+                if glyph.isComposite():
+                    pending.extend(component.glyphName for component in glyph.components)
+            for name in decoded:
+                glyf.glyphs[name] = TTGlyph(self.glyph_data[name])
+        elif "CFF " in self.font:
+            cff = self.font["CFF "].cff
+            char_strings = cff[cff.fontNames[0]].CharStrings
+            if char_strings.charStringsAreIndexed:
+                for name in names:
+                    char_strings.charStringsIndex.items[char_strings.charStrings[name]] = None
@@ -1,14 +1,66 @@
 from typing import Optional, Tuple
 from PIL import Image, ImageEnhance
-from .ttf_loader import Alphabet, extract_alphabet
-from typing import Optional, Dict, Callable
+from .image_loader import prepare_image
+from .progress import Progress, RenderCancelled
+from .text_loader import WordIndex
+from .ttf_loader import Alphabet, Glyph, Typeface, VariableFont, SVGInstruction, SVGCommands, compact_path_data, \
+    extract_alphabet, SVG_LETTER_DICT
+from typing import Optional, Dict, Callable, Iterable, Iterator, List
 from PIL import Image, ImageEnhance, ImageOps
 from copy import deepcopy
 import json
+import uuid
+from contextlib import contextmanager
 from enum import Enum
 import os
 from lxml import etree
 
+MASK_ATTRIBS = {"fill": "white", "stroke": "black", "stroke-width": "20"}
+PAPER_SIZES = {"A5": (148, 210), "A4": (210, 297), "A3": (297, 420), "A2": (420, 594), "A1": (594, 841),
+               "A0": (841, 1189)}
+
+
+def has_absolute_commands(instructions: List[SVGInstruction]) -> bool:
+    """
+    True if the path uses absolute commands behind the first moveto
+    """
+    return any(instruction.command.value.isupper() and instruction.command != SVGCommands.Z
+               for instruction in instructions[1:])
+
+
+@contextmanager
+def partial_file(destination: str, suffix: str = ".part") -> Iterator[str]:
+    """
+    yields a unique temporary file name next to destination, which replaces destination when the block
+    succeeds and is removed otherwise. parallel jobs never see or write each other's half written files
+    """
+    # not mkstemp, its files are only readable by the owner and the output should get the usual permissions
+    partial_destination = f"{destination}.{uuid.uuid4().hex[:12]}{suffix}"
+    try:
+        yield partial_destination
+        os.replace(partial_destination, destination)
+    except BaseException:
+        if os.path.exists(partial_destination):
+            os.remove(partial_destination)
+        raise
+
+
+def save_image(image: Image.Image, destination: str):
+    # the temporary file keeps the extension, pillow picks the format from it
+    with partial_file(destination, suffix=os.path.splitext(destination)[1]) as partial_destination:
+        image.save(partial_destination)
+
+
+def quantize(value: float, minimum: float, maximum: float, buckets: int) -> int:
+    """
+    snaps value to the closest of buckets evenly spaced values between minimum and maximum
+    """
+    if buckets < 2 or maximum == minimum:
+        return round((minimum + maximum) / 2)
+    step = (maximum - minimum) / (buckets - 1)
+    bucket = min(max(round((value - minimum) / step), 0), buckets - 1)
+    return round(minimum + bucket * step)
+
 
 class Mode(Enum):
     fill = "fill"
@@ -37,6 +89,17 @@ class Config:
         self.text_file_name: str = ""
         self.font: str = ""
         self.background_color: str = "white"
+        self.compact_paths: bool = False
+        self.max_image_memory_mb: int = 0
+        self.stream_text: bool = False
+        self.merge_mask_paths: str = ""
+        self.style_buckets: int = 0
+        self.style_output: str = "group"
+        self.font_axis: str = ""
+        self.font_axis_min: Optional[int] = None
+        self.font_axis_max: Optional[int] = None
+        self.font_axis_steps: int = 5
+        self.project_dir: str = os.path.dirname(config_filename) if config_filename is not None else ""
 
         if config_filename is not None:
             with open(config_filename, 'r') as file:
@@ -45,12 +108,37 @@ class Config:
             self.load_mode_from_json()
             self.load_settings_from_json()
 
+    @classmethod
+    def from_dict(cls, json_config: dict, project_dir: str = "") -> "Config":
+        """
+        creates a Config from an already parsed json object instead of a file
+        relative file names are resolved against project_dir
+        """
+        config = cls()
+        config.project_dir = project_dir
+        config.json_config = dict(json_config)
+        config.load_mode_from_json()
+        config.load_settings_from_json()
+        return config
+
     def load_settings_from_json(self):
         for key, value in self.json_config.items():
+            if isinstance(getattr(type(self), key, None), property):
+                raise ValueError(f"{key} is computed from the other settings and can't be set")
             try:
                 setattr(self, key, int(value))
             except Exception:
                 setattr(self, key, value)
+        self.validate()
+
+    def validate(self):
+        """
+        raises a ValueError for settings with an unknown value
+        """
+        if self.merge_mask_paths not in ("", "line", "page"):
+            raise ValueError(f"merge_mask_paths must be 'line' or 'page', not {self.merge_mask_paths}")
+        if self.style_output not in ("class", "group"):
+            raise ValueError(f"style_output must be 'class' or 'group', not {self.style_output}")
 
     def load_mode_from_json(self):
         json_mode = self.json_config.get("mode", None)
@@ -60,6 +148,11 @@ class Config:
             self.mode = Mode(json_mode)
             self.json_config.pop("mode")
 
+    @property
+    def image_size(self) -> Tuple[int, int]:
+        return (self.picture_dimension_x_mm * self.img_pixel_per_mm,
+                self.picture_dimension_y_mm * self.img_pixel_per_mm)
+
     @property
     def max_x(self):
         return (self.picture_dimension_x_mm - self.padding_x_mm) * self.svg_scaling
@@ -78,18 +171,55 @@ class Config:
 
 
 class Converter:
-    def __init__(self, config: Optional[Config] = Config()):
+    def __init__(self, config: Optional[Config] = None, alphabet: Optional[Alphabet] = None,
+                 image: Optional[Image.Image] = None, variable_font: Optional[VariableFont] = None,
+                 progress_callback: Optional[Callable[[Progress], None]] = None,
+                 typeface: Optional[Typeface] = None):
+        """
+        a converter holds the state of one render job.
+        typeface (or alphabet and variable_font) and image can be passed in if they are already loaded
+        (e.g. from a cache), otherwise they are loaded from the paths in the config. they are only read,
+        so one typeface and image can be shared by converters running in parallel threads.
+        progress_callback is called after every line of a render, see letterart.progress
+        """
+        if config is None:
+            config = Config()
+        config.validate()
         self.config = config
-        self.project_dir = os.path.dirname(self.config.config_filename)
+        self.project_dir = self.config.project_dir
 
         self.image_path = os.path.join(self.project_dir, config.picture_name)
         self.text_path = os.path.join(self.project_dir, config.text_file_name)
         self.font_path = os.path.join(self.project_dir, config.font)
-        self.image = self.get_and_prepare_image()
-
-        self.text_as_str = self.get_text()
-        self.alphabet = extract_alphabet(self.font_path, flip_horizontally=True)
+        self.image = image if image is not None else self.get_and_prepare_image()
+        self.gray_image: Optional[Image.Image] = None
+
+        self.text_as_str = None if config.stream_text else self.get_text()
+        self.word_index: Optional[WordIndex] = None
+        if typeface is None:
+            if alphabet is None:
+                alphabet = extract_alphabet(self.font_path, flip_horizontally=True)
+            if variable_font is None and config.font_axis:
+                variable_font = VariableFont(self.font_path, flip_horizontally=True)
+            typeface = Typeface(alphabet, variable_font)
+        self.typeface = typeface
+        self.alphabet = typeface.alphabet
+        self.variable_font = typeface.variable_font
+        if config.font_axis:
+            if self.variable_font is None:
+                raise ValueError(f"font_axis {config.font_axis} needs a typeface that was loaded as variable font")
+            if config.font_axis not in self.variable_font.axes:
+                raise ValueError(f"{config.font_axis} is not an axis of {self.variable_font.filename}, "
+                                 f"use one of {', '.join(self.variable_font.axes)}")
+            if config.mode != Mode.fill:
+                raise ValueError(f"font_axis only works in the fill mode, not in the {config.mode.value} mode")
         self.svg_file = self.create_svg_structure()
+        self.compact_path_cache: Dict[tuple, str] = {}
+        self.style_classes: Dict[tuple, str] = {}
+        self.style_element: Optional[etree.Element] = None
+        self.progress_callback = progress_callback
+        self.progress: Optional[Progress] = None
+        self.cancelled = False
 
     def create_svg_structure(self):
         svg = etree.Element("svg", {"version": "1.0", "xmlns": "http://www.w3.org/2000/svg",
@@ -103,18 +233,34 @@ class Converter:
         with open(self.text_path, 'r', encoding="utf-8") as file:
             return file.read().replace('\n', ' ')
 
+    def get_words(self):
+        """
+        with stream_text the words are read from the memory mapped text file instead of a string in memory
+        """
+        if self.text_as_str is not None:
+            return self.text_as_str.split(' ')
+        if self.word_index is None:
+            self.word_index = WordIndex(self.text_path)
+        return self.word_index
+
+    def close_words(self):
+        """
+        closes the memory mapped text file of stream_text, it is opened again by the next get_words
+        """
+        if self.word_index is not None:
+            self.word_index.close()
+            self.word_index = None
+
     def get_and_prepare_image(self):
-        image = Image.open(self.image_path)
         if self.config.mode == Mode.grayscale:
-            image = image.convert('L')
+            mode = 'L'
         else:
-            image = image.convert('RGB')
+            mode = 'RGB'
 
         # enhancer = ImageEnhance.Contrast(image)
         # image = enhancer.enhance(self.config.contrast_enhance)
 
-        return image.resize((self.config.picture_dimension_x_mm * self.config.img_pixel_per_mm,
-                             self.config.picture_dimension_y_mm * self.config.img_pixel_per_mm))
+        return prepare_image(self.image_path, mode, self.config.image_size, self.config.max_image_memory_mb)
 
     def get_footer(self):
         footer = """
@@ -123,21 +269,63 @@ class Converter:
         return footer
 
     def get_projected_center(self, letter) -> Tuple[int, int]:
-        abs_center_x = round(letter.abs_center[0] / self.config.svg_scaling * self.config.img_pixel_per_mm) % (
+        return self.get_projected_point(*letter.abs_center)
+
+    def get_projected_point(self, x: int, y: int) -> Tuple[int, int]:
+        abs_center_x = round(x / self.config.svg_scaling * self.config.img_pixel_per_mm) % (
                 self.config.picture_dimension_x_mm * self.config.img_pixel_per_mm)
-        abs_center_y = round(letter.abs_center[1] / self.config.svg_scaling * self.config.img_pixel_per_mm) % (
+        abs_center_y = round(y / self.config.svg_scaling * self.config.img_pixel_per_mm) % (
                 self.config.picture_dimension_y_mm * self.config.img_pixel_per_mm)
 
         return abs_center_x, abs_center_y
 
+    def get_gray_image(self) -> Image.Image:
+        """
+        grayscale version of the image for Mode.fill, self.image itself is never replaced
+        """
+        if self.gray_image is None:
+            self.gray_image = self.image.convert("L")
+        return self.gray_image
+
     def set_strokewidth_of(self, letter):
         abs_center_x, abs_center_y = self.get_projected_center(letter)
-        color = self.image.getpixel((abs_center_x, abs_center_y))
+        color = self.get_gray_image().getpixel((abs_center_x, abs_center_y))
         b = self.config.max_stroke_width
         m = (self.config.min_stroke_width - b) / 255
         stroke_width = round(color * m + b)
+        if self.config.style_buckets > 0:
+            stroke_width = quantize(stroke_width, self.config.min_stroke_width, self.config.max_stroke_width,
+                                    self.config.style_buckets)
         letter.set_strokewidth(stroke_width)
 
+    def get_variable_letter(self, glyph: Glyph, loc_x: int, loc_y: int) -> Glyph:
+        """
+        returns a copy of the glyph from the font instance that matches the darkness of the image below it,
+        moved to the place of the default glyph at (loc_x, loc_y). darker regions get higher values of font_axis.
+        the darkness is quantized to font_axis_steps, so the font is instanced at most that many times
+        """
+        # the default glyph of the typeface is not moved, its viewbox is shifted by the location instead
+        x_min, y_min, x_max, y_max = (glyph.viewbox[0] + loc_x, glyph.viewbox[1] + loc_y,
+                                      glyph.viewbox[2] + loc_x, glyph.viewbox[3] + loc_y)
+        abs_center_x, abs_center_y = self.get_projected_point(round(x_min + (x_max - x_min) / 2),
+                                                              round(y_min + (y_max - y_min) / 2))
+        color = self.get_gray_image().getpixel((abs_center_x, abs_center_y))
+        steps = max(2, self.config.font_axis_steps)
+        step = round((255 - color) / 255 * (steps - 1))
+        minimum, _, maximum = self.variable_font.axes[self.config.font_axis]
+        if self.config.font_axis_min is not None:
+            minimum = self.config.font_axis_min
+        if self.config.font_axis_max is not None:
+            maximum = self.config.font_axis_max
+        value = minimum + (maximum - minimum) * step / (steps - 1)
+        typeface = self.variable_font.typeface({self.config.font_axis: value})
+
+        variable_letter = deepcopy(typeface.glyphs[glyph.name])
+        # the line was laid out with the default glyph, so the instance is centered on it
+        offset = (glyph.viewbox[0] + glyph.viewbox[2] - variable_letter.viewbox[0] - variable_letter.viewbox[2]) // 2
+        variable_letter.move_to(loc_x + offset, loc_y)
+        return variable_letter
+
     def set_color_of(self, letter):
         abs_center_x, abs_center_y = self.get_projected_center(letter)
         color = self.image.getpixel((abs_center_x, abs_center_y))
@@ -150,44 +338,215 @@ class Converter:
 
 
     def get_body(self):
-        self.image = self.image.convert("L")
-        loc_x = self.config.min_x
+        words_list = self.get_words()
+        groups: Dict[str, etree.Element] = {}
+        for start_idx, number_words, new_backspace, loc_y in self.iter_lines(words_list):
+            elements = self.line_elements(words_list, start_idx, number_words, new_backspace, loc_y)
+            if self.config.style_buckets > 0 and self.config.style_output == "group":
+                self.group_by_style(elements, groups)
+            else:
+                self.svg_file.extend(elements)
+        if self.config.style_buckets > 0 and self.config.style_output != "group":
+            self.add_style_classes()
+
+    def style_class_of(self, letter: Glyph) -> str:
+        """
+        name of the css class for the style of the letter, every distinct style gets its own class
+        """
+        key = (letter.stroke, str(letter.stroke_width), letter.fill)
+        name = self.style_classes.get(key)
+        if name is None:
+            name = f"s{len(self.style_classes)}"
+            self.style_classes[key] = name
+        return name
+
+    def add_style_classes(self) -> etree.Element:
+        """
+        creates or updates the style element with one css class per distinct letter style
+        """
+        if self.style_element is None:
+            self.style_element = etree.Element("style")
+            self.svg_file.insert(0, self.style_element)
+        self.style_element.text = "".join(f".{name}{{stroke:{stroke};stroke-width:{stroke_width};fill:{fill}}}"
+                                          for (stroke, stroke_width, fill), name in self.style_classes.items())
+        return self.style_element
+
+    def group_by_style(self, elements: List[etree.Element], groups: Dict[str, etree.Element]):
+        """
+        moves the elements into one g element per style class, the group carries the style attributes
+        """
+        styles = {name: key for key, name in self.style_classes.items()}
+        for element in elements:
+            name = element.attrib.pop("class")
+            if name not in groups:
+                stroke, stroke_width, fill = styles[name]
+                groups[name] = etree.SubElement(self.svg_file, "g",
+                                                {"stroke": stroke, "stroke-width": stroke_width, "fill": fill})
+            groups[name].append(element)
+
+    def iter_lines(self, words_list: list) -> Iterator[Tuple[int, int, int, int]]:
+        """
+        yields start_idx, number_words, new_backspace and loc_y of every line of the picture
+        """
         loc_y = self.config.min_y
         start_idx = 0
-        words_list = self.text_as_str.split(' ')
         while loc_y < self.config.max_y:
+            self.check_cancelled()
             number_words, new_backspace = self.get_idx_and_space_size(words_list, start_idx)
-            words_in_line_list = self.get_from_(words_list, start_idx, number_words)
+            yield start_idx, number_words, new_backspace, loc_y
             start_idx = (start_idx + number_words) % (len(words_list) - 1)
-            word_in_line_str = " ".join(words_in_line_list)
-            for letter in word_in_line_str:
-                if letter == " ":
-                    loc_x += new_backspace
-                    continue
-                try:
-                    new_letter = deepcopy(self.alphabet[letter])
-                except Exception:
-                    continue
+            loc_y += self.config.space_y
+            if self.progress is not None:
+                self.progress.lines_done += 1
+                self.report_progress()
+
+    @property
+    def total_lines(self) -> int:
+        return len(range(self.config.min_y, self.config.max_y, self.config.space_y))
+
+    def report_progress(self, phase: Optional[str] = None):
+        if phase is not None:
+            self.progress.phase = phase
+        if self.progress_callback is not None:
+            self.progress_callback(self.progress)
+
+    def cancel(self):
+        """
+        stops a running render at the next line, can be called from the progress callback or another thread
+        """
+        self.cancelled = True
+
+    def start_progress(self):
+        """
+        starts the progress of a new render, a cancel only stops the render that is running when it is called
+        """
+        self.cancelled = False
+        self.progress = Progress(self.total_lines)
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise RenderCancelled("render was cancelled")
 
+    def place_letters(self, words_list: list, start_idx: int, number_words: int, new_backspace: int,
+                      loc_y: int, variable: bool = False) -> Iterator[Glyph]:
+        """
+        yields a moved copy of the glyph for every letter of the line. with variable and font_axis the copy is
+        taken from the font instance that matches the image, the line is still laid out with the default glyphs
+        """
+        loc_x = self.config.min_x
+        words_in_line_list = self.get_from_(words_list, start_idx, number_words)
+        word_in_line_str = " ".join(words_in_line_list)
+        placed = 0
+        for letter in word_in_line_str:
+            if letter == " ":
+                loc_x += new_backspace
+                continue
+            glyph = self.typeface.glyphs.get(SVG_LETTER_DICT.get(letter, letter))
+            if glyph is None:
+                continue
+
+            if variable and self.config.font_axis:
+                new_letter = self.get_variable_letter(glyph, loc_x, loc_y)
+            else:
+                new_letter = deepcopy(glyph)
                 new_letter.move_to(loc_x, loc_y)
+            yield new_letter
+            placed += 1
 
+            old_x_max = loc_x + glyph.width
+            loc_x = old_x_max + self.config.space_x
+        if self.progress is not None:
+            self.progress.letters_placed += placed
+
+    def line_elements(self, words_list: list, start_idx: int, number_words: int, new_backspace: int, loc_y: int,
+                      attribs: Optional[dict] = None) -> List[etree.Element]:
+        """
+        creates the path elements of one line
+        without attribs the stroke width of every letter is taken from the image (Mode.fill).
+        with attribs and merge_mask_paths all letters of the line share one compound path
+        """
+        letters = self.place_letters(words_list, start_idx, number_words, new_backspace, loc_y, attribs is None)
+        if attribs is not None and self.config.merge_mask_paths:
+            path_data, _ = self.merged_path_of(letters)
+            if not path_data:
+                return []
+            path_attribs = {"d": path_data}
+            path_attribs.update(attribs)
+            return [etree.Element("path", path_attribs)]
+
+        elements = []
+        for new_letter in letters:
+            if attribs is None:
                 self.set_strokewidth_of(new_letter)
-                etree.SubElement(self.svg_file, "path",
-                                 {"d": new_letter.path, "stroke": new_letter.stroke,
-                                  "stroke-width": str(new_letter.stroke_width), "fill": new_letter.fill})
+                if self.config.style_buckets > 0:
+                    path_attribs = {"d": self.path_of(new_letter), "class": self.style_class_of(new_letter)}
+                else:
+                    path_attribs = {"d": self.path_of(new_letter), "stroke": new_letter.stroke,
+                                    "stroke-width": str(new_letter.stroke_width), "fill": new_letter.fill}
+            else:
+                path_attribs = {"d": self.path_of(new_letter)}
+                path_attribs.update(attribs)
+            elements.append(etree.Element("path", path_attribs))
+        return elements
 
-                old_x_max = new_letter.x_coord + new_letter.width
-                loc_x = old_x_max + self.config.space_x
+    def path_of(self, letter: Glyph) -> str:
+        if not self.config.compact_paths:
+            return letter.path
+        instructions = letter.contours[0].svg_instructions
+        return compact_path_data(instructions[:1]) + self.compact_tail_of(letter)
 
-            loc_x = self.config.min_x
-            loc_y += self.config.space_y
+    def compact_tail_of(self, letter: Glyph) -> str:
+        """
+        compact path data of the letter behind the first moveto
+        """
+        instructions = letter.contours[0].svg_instructions
+        if has_absolute_commands(instructions) or self.config.font_axis:
+            # the instances of a variable font share the glyph names, so their tails can't be cached by name
+            return compact_path_data(instructions)[len(compact_path_data(instructions[:1])):]
+
+        # everything behind the first moveto is relative, so the encoding of the rest of the path does not
+        # depend on the position of the glyph and can be reused for every placement of the glyph
+        tail = self.compact_path_cache.get(letter.name)
+        if tail is None:
+            tail = compact_path_data(instructions)[len(compact_path_data(instructions[:1])):]
+            self.compact_path_cache[letter.name] = tail
+        return tail
+
+    def merged_path_of(self, letters: Iterable[Glyph],
+                       current_point: Optional[Tuple[int, int]] = None) -> Tuple[str, Optional[Tuple[int, int]]]:
+        """
+        path data of all letters as one compound path and the current point at its end.
+        the glyph paths are closed, so every glyph ends at the start of its last subpath and the next glyph
+        is reached with a short relative moveto from there
+        """
+        parts = []
+        for letter in letters:
+            instructions = letter.contours[0].svg_instructions
+            start_x, start_y = instructions[0].coordinates
+            if current_point is None or has_absolute_commands(instructions):
+                head = instructions[:1]
+            else:
+                head = [SVGInstruction(SVGCommands.m, [start_x - current_point[0], start_y - current_point[1]])]
+
+            if self.config.compact_paths:
+                parts.append(compact_path_data(head) + self.compact_tail_of(letter))
+            else:
+                parts.append(head[0].text + letter.path[len(instructions[0].text):])
+
+            for instruction in instructions[1:]:
+                if instruction.command == SVGCommands.m:
+                    start_x += instruction.coordinates[0]
+                    start_y += instruction.coordinates[1]
+                elif instruction.command == SVGCommands.M:
+                    start_x, start_y = instruction.coordinates
+            current_point = (start_x, start_y)
+        return "".join(parts), current_point
 
     def calc_length_of(self, word: str) -> int:
         length = 0
         for letter in word:
             try:
-                svg_letter = deepcopy(self.alphabet[letter])
-                length += svg_letter.width
+                length += self.typeface.width(letter)
                 length += self.config.space_x
             except Exception:
                 pass
@@ -197,9 +556,11 @@ class Converter:
         num_words = 0
         previous_length = 0
         length = -self.config.backspace
-        double_words_list = words_list + words_list
         max_usable_x = self.config.max_x - self.config.min_x
-        for num_words, word in enumerate(double_words_list[start_idx:]):
+        # walks through the words as if the list was doubled, without copying it
+        number_of_words = len(words_list)
+        for num_words in range(2 * number_of_words - start_idx):
+            word = words_list[(start_idx + num_words) % number_of_words]
             length += self.calc_length_of(word)
             length += self.config.backspace
 
@@ -218,39 +579,26 @@ class Converter:
             return wordlist[start_idx:] + wordlist[:stop_idx]
 
     def add_paths(self, parent: etree.Element, attribs: dict):
-        loc_x = self.config.min_x
-        loc_y = self.config.min_y
-        start_idx = 0
-        words_list = self.text_as_str.split(' ')
-        while loc_y < self.config.max_y:
-            number_words, new_backspace = self.get_idx_and_space_size(words_list, start_idx)
-            words_in_line_list = self.get_from_(words_list, start_idx, number_words)
-            start_idx = (start_idx + number_words) % (len(words_list) - 1)
-            word_in_line_str = " ".join(words_in_line_list)
-            for letter in word_in_line_str:
-                if letter == " ":
-                    loc_x += new_backspace
-                    continue
-                try:
-                    new_letter = deepcopy(self.alphabet[letter])
-                except Exception:
-                    continue
-
-                new_letter.move_to(loc_x, loc_y)
-                path_attribs = {"d": new_letter.path}
-                path_attribs.update(attribs)
-                etree.SubElement(parent, "path", path_attribs)
-
-                old_x_max = new_letter.x_coord + new_letter.width
-                loc_x = old_x_max + self.config.space_x
-
-            loc_x = self.config.min_x
-            loc_y += self.config.space_y
-
-    def create_mask(self):
+        words_list = self.get_words()
+        if self.config.merge_mask_paths == "page":
+            parts = []
+            current_point = None
+            for start_idx, number_words, new_backspace, loc_y in self.iter_lines(words_list):
+                letters = self.place_letters(words_list, start_idx, number_words, new_backspace, loc_y)
+                path_data, current_point = self.merged_path_of(letters, current_point)
+                parts.append(path_data)
+            path_attribs = {"d": "".join(parts)}
+            path_attribs.update(attribs)
+            parent.append(etree.Element("path", path_attribs))
+            return
+        for start_idx, number_words, new_backspace, loc_y in self.iter_lines(words_list):
+            parent.extend(self.line_elements(words_list, start_idx, number_words, new_backspace, loc_y, attribs))
+
+    def create_mask(self) -> etree.Element:
         defs = etree.SubElement(self.svg_file, "defs")
         mask = etree.SubElement(defs, "mask", {"id": "mask1"})
-        self.add_paths(mask, {"fill": "white", "stroke": "black", "stroke-width": "20"})
+        self.add_paths(mask, MASK_ATTRIBS)
+        return mask
 
     def add_foreground(self):
         etree.SubElement(self.svg_file, "rect",
@@ -262,32 +610,118 @@ class Converter:
                          {"x": "0", "y": "0", "width": "100%", "height": "100%",
                           "href": os.path.basename(self.image_path), "mask": "url(#mask1)"})
 
-    def add_grayscale_background(self):
-        image_gray = self.image.convert("L")
+    def add_grayscale_background(self, save_background: bool = True):
         old_name, ending = self.config.picture_name.split(".")
         new_name = f"{old_name}_grayscale.{ending}"
-        destination = os.path.join(self.project_dir, new_name)
-        image_gray.save(destination)
+        if save_background:
+            image_gray = self.image.convert("L")
+            save_image(image_gray, os.path.join(self.project_dir, new_name))
         etree.SubElement(self.svg_file, "image",
                          {"x": "0", "y": "0", "width": "100%", "height": "100%",
                           "href": new_name, "mask": "url(#mask1)"})
 
+    def render(self, save_background: bool = True) -> etree.Element:
+        """
+        lays out the picture, in the grayscale mode save_background=False skips writing the background image
+        """
+        self.start_progress()
+        # every render starts from an empty svg, so a converter can render (and save) any number of times
+        self.svg_file = self.create_svg_structure()
+        self.style_classes = {}
+        self.style_element = None
+        try:
+            if self.config.mode == Mode.color:
+                self.create_mask()
+                self.add_foreground()
+                self.add_background()
+            elif self.config.mode == Mode.grayscale:
+                self.create_mask()
+                self.add_foreground()
+                self.add_grayscale_background(save_background)
+            elif self.config.mode == Mode.fill:
+                self.get_body()
+        finally:
+            self.close_words()
+        return self.svg_file
+
+    def to_bytes(self, save_background: bool = True) -> bytes:
+        return etree.tostring(self.render(save_background), pretty_print=True, xml_declaration=True,
+                              encoding="utf-8")
+
     def save_file(self, destination: Optional[str] = "export.svg"):
         if not destination.endswith('.svg'):
             destination += '.svg'
 
         destination = os.path.join(self.project_dir, destination)
 
-        if self.config.mode == Mode.color:
-            self.create_mask()
-            self.add_foreground()
-            self.add_background()
-        elif self.config.mode == Mode.grayscale:
-            self.create_mask()
-            self.add_foreground()
-            self.add_grayscale_background()
-        elif self.config.mode == Mode.fill:
-            self.get_body()
-
-        tree = etree.ElementTree(self.svg_file)
-        tree.write(destination, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        self.write_svg(self.render(), destination)
+        self.report_progress("done")
+
+    def write_svg(self, svg_file: etree.Element, destination: str):
+        """
+        writes to a temporary file next to destination first, so a cancelled or failed write
+        never leaves a truncated svg behind
+        """
+        self.report_progress("writing")
+        self.check_cancelled()
+        with partial_file(destination) as partial_destination:
+            tree = etree.ElementTree(svg_file)
+            tree.write(partial_destination, pretty_print=True, xml_declaration=True, encoding="utf-8")
+
+    def save_sizes(self, sizes: list, destination: Optional[str] = "export.svg") -> List[str]:
+        """
+        lays out the picture once and saves it in several print sizes
+        sizes are names of PAPER_SIZES or (x_mm, y_mm) tuples, the size is appended to the file name.
+        the layout is kept in viewBox coordinates, so only width and height of the svg change and the text density
+        relative to the page stays the same. sizes with another aspect ratio are centered on the page.
+        only the grayscale background image is resampled for every size, it keeps the aspect ratio of the layout
+        """
+        if destination.endswith('.svg'):
+            destination = destination[:-4]
+
+        svg_file = self.render(save_background=False)
+        if self.config.mode == Mode.grayscale:
+            background = svg_file.find("image")
+            # the resampled image has the aspect ratio of the viewBox up to rounding, it has to cover it exactly
+            background.set("preserveAspectRatio", "none")
+
+        destinations = []
+        written = []
+        try:
+            for size in sizes:
+                size_name = size if isinstance(size, str) else f"{size[0]}x{size[1]}mm"
+                size_x_mm, size_y_mm = PAPER_SIZES[size] if isinstance(size, str) else size
+                svg_file.set("width", f"{size_x_mm}mm")
+                svg_file.set("height", f"{size_y_mm}mm")
+                if self.config.mode == Mode.grayscale:
+                    self.check_cancelled()
+                    image_name = self.save_grayscale_image(size_x_mm, size_y_mm, size_name)
+                    written.append(os.path.join(self.project_dir, image_name))
+                    background.set("href", image_name)
+
+                size_destination = os.path.join(self.project_dir, f"{destination}_{size_name}.svg")
+                self.write_svg(svg_file, size_destination)
+                written.append(size_destination)
+                destinations.append(size_destination)
+        except RenderCancelled:
+            # the sizes are only useful together, so the ones that were already saved are removed as well
+            for path in written:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        self.report_progress("done")
+        return destinations
+
+    def save_grayscale_image(self, size_x_mm: int, size_y_mm: int, size_name: str) -> str:
+        """
+        the background is resampled with the aspect ratio of the layout, scaled like the viewBox is scaled onto
+        a page of size_x_mm x size_y_mm
+        """
+        old_name, ending = self.config.picture_name.split(".")
+        new_name = f"{old_name}_grayscale_{size_name}.{ending}"
+        scale = min(size_x_mm / self.config.picture_dimension_x_mm, size_y_mm / self.config.picture_dimension_y_mm)
+        image_size = (max(1, round(self.config.picture_dimension_x_mm * scale * self.config.img_pixel_per_mm)),
+                      max(1, round(self.config.picture_dimension_y_mm * scale * self.config.img_pixel_per_mm)))
+        image_gray = prepare_image(self.image_path, "L", image_size, self.config.max_image_memory_mb)
+        save_image(image_gray, os.path.join(self.project_dir, new_name))
+        return new_name
@@ -0,0 +1,55 @@
+"""
+Memory mapped text input for very long backstories.
+
+Instead of a list of strings, WordIndex keeps the byte offsets of the words in an array and decodes a word only
+when it is accessed. It splits the text exactly like text.replace('\n', ' ').split(' ') on the decoded file.
+"""
+import mmap
+import re
+from array import array
+from typing import Union, List
+
+# a text file opened in text mode turns \r\n and \r into \n, which are then replaced by spaces
+SEPARATOR = re.compile(rb"\r\n|[ \n\r]")
+
+
+class WordIndex:
+    def __init__(self, filename: str, encoding: str = "utf-8"):
+        self.filename = filename
+        self.encoding = encoding
+        self.file = open(filename, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            self.mm = b""
+        self.starts = array('Q', [0])
+        self.ends = array('Q')
+        for match in SEPARATOR.finditer(self.mm):
+            self.ends.append(match.start())
+            self.starts.append(match.end())
+        self.ends.append(len(self.mm))
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+    def __enter__(self) -> "WordIndex":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(item, slice):
+            return [self.word(idx) for idx in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        return self.word(item)
+
+    def word(self, idx: int) -> str:
+        return self.mm[self.starts[idx]:self.ends[idx]].decode(self.encoding)
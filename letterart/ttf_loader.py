@@ -1,11 +1,16 @@
 from __future__ import annotations
 from lxml import etree
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 from enum import Enum
 from copy import deepcopy
 from functools import cache
 import re
+import os
+import tempfile
+import threading
 from fontTools import ttx
+from fontTools.ttLib import TTFont
+from fontTools.varLib import instancer
 
 SVG_LETTER_DICT = {",": "comma", ":": "colon", ".": "period", "0": "zero", "1": "one", "2": "two", "3": "three",
                    "4": "four", "5": "five", "6": "six", "7": "seven", "8": "eight", "9": "nine", "ß": "uni1E9E",
@@ -50,6 +55,90 @@ class SVGInstruction:
         return f"{self.command.value} {' '.join(map(str, self.coordinates))} "
 
 
+def format_number(value) -> str:
+    """
+    shortest svg representation of a number, e.g. 0.5 -> .5 and -0.5 -> -.5
+    """
+    if value == int(value):
+        return str(int(value))
+    text = f"{value:.3f}".rstrip("0")
+    if text.startswith("0."):
+        return text[1:]
+    if text.startswith("-0."):
+        return "-" + text[2:]
+    return text
+
+
+def compact_path_data(svg_instructions: list[SVGInstruction]) -> str:
+    """
+    encodes the instructions with the shortest svg path syntax (implicit repeated commands, no redundant
+    separators, h and v for horizontal and vertical lines), the points themselves are not changed
+    """
+    result = []
+    previous_command = None
+    last_char = ""
+
+    def add(command: str, numbers: list):
+        nonlocal previous_command, last_char
+        # a command letter can be left out if it repeats the previous one, after a moveto the
+        # implicit command is a lineto
+        implicit = (command == previous_command and command not in "MmZz") or \
+                   (previous_command, command) in (("m", "l"), ("M", "L"))
+        if not implicit:
+            result.append(command)
+            last_char = command
+        previous_command = command
+
+        for number in numbers:
+            text = format_number(number)
+            if last_char.isdigit() or last_char == ".":
+                if text[0].isdigit() or (text[0] == "." and "." not in result[-1]):
+                    result.append(" ")
+            result.append(text)
+            last_char = text[-1]
+
+    x = y = start_x = start_y = 0
+    for instruction in svg_instructions:
+        command = instruction.command.value
+        if command in "Zz":
+            add(command, [])
+            x, y = start_x, start_y
+            continue
+
+        coordinates = instruction.coordinates
+        if command in "Ll":
+            # every point of a lineto is its own segment, horizontal and vertical ones only need one number
+            for idx in range(0, len(coordinates), 2):
+                point_x, point_y = coordinates[idx], coordinates[idx + 1]
+                if command == "l":
+                    if point_y == 0:
+                        add("h", [point_x])
+                    elif point_x == 0:
+                        add("v", [point_y])
+                    else:
+                        add("l", [point_x, point_y])
+                    x, y = x + point_x, y + point_y
+                else:
+                    if point_y == y:
+                        add("H", [point_x])
+                    elif point_x == x:
+                        add("V", [point_y])
+                    else:
+                        add("L", [point_x, point_y])
+                    x, y = point_x, point_y
+            continue
+
+        # the points of a relative command are all relative to the current point before the command
+        if command.islower():
+            x, y = x + coordinates[-2], y + coordinates[-1]
+        else:
+            x, y = coordinates[-2], coordinates[-1]
+        if command in "Mm":
+            start_x, start_y = x, y
+        add(command, coordinates)
+    return "".join(result)
+
+
 class Contour:
     def __init__(self):
         self.svg_instructions: list[SVGInstruction] = []
@@ -71,6 +160,9 @@ class Contour:
         temp_string += "\n"
         return temp_string
 
+    def compact_text(self) -> str:
+        return compact_path_data(self.svg_instructions)
+
     def transform_to_relative_coordinates(self):
         copied_instructions = deepcopy(self.svg_instructions)
         need_transformation = any(instruction.command.value.isupper() for instruction in copied_instructions[1:])
@@ -164,6 +256,12 @@ class Glyph:
             result += f"""{instruction.command.value} {" ".join(map(str, instruction.coordinates))} """
         return result
 
+    def compact_path(self) -> str:
+        """
+        same as path, but with the shortest svg syntax, see compact_path_data
+        """
+        return self.contours[0].compact_text()
+
     def merge_contours(self):
         new_contour = Contour()
         new_contour.add_svg_instructions(self.contours[0].svg_instructions)
@@ -251,6 +349,57 @@ class Glyph:
         return result
 
 
+class VariableFont:
+    """
+    variable ttf font that is instanced at axis locations (e.g. {"wght": 700})
+    every instance is cached as a Typeface by its location, so every distinct location is only instanced once
+    """
+
+    def __init__(self, filename: str, flip_horizontally: Optional[bool] = False,
+                 flip_vertically: Optional[bool] = False):
+        self.filename = filename
+        self.flip_horizontally = flip_horizontally
+        self.flip_vertically = flip_vertically
+        self.font = TTFont(filename)
+        if "fvar" not in self.font:
+            raise ValueError(f"{filename} is not a variable font")
+        self.axes: Dict[str, Tuple[float, float, float]] = {
+            axis.axisTag: (axis.minValue, axis.defaultValue, axis.maxValue) for axis in self.font["fvar"].axes}
+        self.typefaces: Dict[tuple, "Typeface"] = {}
+        # instancing reads the lazily loaded tables of self.font, which must not happen in two threads at once
+        self.lock = threading.Lock()
+
+    def location_key(self, location: Dict[str, float]) -> tuple:
+        """
+        complete location with every axis of the font, missing axes are set to their default value
+        and values outside of the axis range are clamped
+        """
+        full_location = {tag: default for tag, (_, default, _) in self.axes.items()}
+        for tag, value in location.items():
+            if tag not in self.axes:
+                raise ValueError(f"{tag} is not an axis of {self.filename}, use one of {', '.join(self.axes)}")
+            minimum, _, maximum = self.axes[tag]
+            full_location[tag] = min(max(value, minimum), maximum)
+        return tuple(sorted(full_location.items()))
+
+    def typeface(self, location: Optional[Dict[str, float]] = None) -> "Typeface":
+        key = self.location_key(location or {})
+        typeface = self.typefaces.get(key)
+        if typeface is None:
+            with self.lock:
+                typeface = self.typefaces.get(key)
+                if typeface is None:
+                    instance = instancer.instantiateVariableFont(self.font, dict(key), inplace=False)
+                    round_coordinates(instance)
+                    typeface = Typeface(extract_alphabet_from_font(instance, self.flip_horizontally,
+                                                                   self.flip_vertically))
+                    self.typefaces[key] = typeface
+        return typeface
+
+    def alphabet(self, location: Optional[Dict[str, float]] = None) -> Alphabet:
+        return self.typeface(location).alphabet
+
+
 class Alphabet:
     def __init__(self, filename: Optional[str] = None):
         self.glyphs: list[Glyph] = []
@@ -333,35 +482,81 @@ class Alphabet:
             glyph.transform_to_relative_coordinates()
 
     def show(self, filename):
-        svg_code = ""
-        svg_body = ""
-        prev_x = 0
-        prev_y = 1000
-        MAX_X = 10000
-        for glyph in self.glyphs:
-            glyph.move_to(prev_x, prev_y)
-            for contour in glyph.contours:
-                svg_body += f"""<path d="{contour.text}" fill="{contour.fill}" stroke="{contour.stroke}" transform="{contour.transform}" stroke-width="{contour.stroke_width}"/>\n"""
-            svg_body += f"""<circle cx="{prev_x}" cy="{prev_y}" r="25" fill="none" stroke="red" stroke-width="10" />\n"""
-            svg_body += f"""<text x="{prev_x}" y="{prev_y}" class="heavy" fill="black" font-size="230px"> {glyph.name}</text>"""
-            prev_x += 1000
-            if prev_x >= MAX_X:
-                prev_x = 0
-                prev_y += 1000
-
-        HEADER = f"""<?xml version="1.0" standalone="no"?>
+        """
+        writes all glyphs with their names into one svg, for fonts with many glyphs use letterart.specimen
+        """
+        write_glyph_sheet(self.glyphs, filename, with_names=True)
+
+
+class Typeface:
+    """
+    read-only glyphs of a font, shared by any number of converters, also in parallel threads.
+    converters never change these glyphs, they only place copies of them
+    """
+
+    def __init__(self, alphabet: Alphabet, variable_font: Optional[VariableFont] = None):
+        self.alphabet = alphabet
+        self.variable_font = variable_font
+        self.glyphs: Dict[str, Glyph] = {}
+        for glyph in alphabet.glyphs:
+            # the first glyph of a name wins, like in Alphabet.__getitem__
+            self.glyphs.setdefault(glyph.name, glyph)
+        self.widths: Dict[str, int] = {name: glyph.width for name, glyph in self.glyphs.items()}
+
+    @classmethod
+    def from_file(cls, filename: str, variable: bool = False) -> "Typeface":
+        """
+        variable fonts are only instanced when variable is True
+        """
+        variable_font = VariableFont(filename, flip_horizontally=True) if variable else None
+        return cls(extract_alphabet(filename, flip_horizontally=True), variable_font)
+
+    def glyph(self, letter: str) -> Glyph:
+        """
+        a copy of the glyph of letter that can be moved and styled
+        """
+        return deepcopy(self.glyphs[SVG_LETTER_DICT.get(letter, letter)])
+
+    def width(self, letter: str) -> int:
+        return self.widths[SVG_LETTER_DICT.get(letter, letter)]
+
+    def __contains__(self, letter: str) -> bool:
+        return SVG_LETTER_DICT.get(letter, letter) in self.glyphs
+
+
+def write_glyph_sheet(glyphs: List[Glyph], filename: str, with_names: bool = False):
+    """
+    writes the glyphs in rows of ten into a svg. the glyphs are placed with a transform, so they are not moved
+    """
+    parts = []
+    prev_x = 0
+    prev_y = 1000
+    MAX_X = 10000
+    for glyph in glyphs:
+        parts.append(f"""<g transform="translate({prev_x - glyph.x_coord} {prev_y - glyph.y_coord})">\n""")
+        for contour in glyph.contours:
+            parts.append(f"""<path d="{contour.text}" fill="{contour.fill}" stroke="{contour.stroke}" transform="{contour.transform}" stroke-width="{contour.stroke_width}"/>\n""")
+        parts.append("</g>\n")
+        parts.append(f"""<circle cx="{prev_x}" cy="{prev_y}" r="25" fill="none" stroke="red" stroke-width="10" />\n""")
+        if with_names:
+            parts.append(f"""<text x="{prev_x}" y="{prev_y}" class="heavy" fill="black" font-size="230px"> {glyph.name}</text>""")
+        prev_x += 1000
+        if prev_x >= MAX_X:
+            prev_x = 0
+            prev_y += 1000
+
+    HEADER = f"""<?xml version="1.0" standalone="no"?>
     <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 20010904//EN"
             "http://www.w3.org/TR/2001/REC-SVG-20010904/DTD/svg10.dtd">
     <svg version="1.0" xmlns="http://www.w3.org/2000/svg"
          width="210mm" height="297mm" viewBox="0 0 {MAX_X} {abs(prev_y)}">"""
 
-        FOOTER = "</svg>"
+    FOOTER = "</svg>"
 
-        svg_code += HEADER
-        svg_code += svg_body
-        svg_code += FOOTER
-        with open(filename, 'w') as file:
-            file.write(svg_code)
+    with open(filename, 'w') as file:
+        file.write(HEADER)
+        file.write("".join(parts))
+        file.write(FOOTER)
 
 
 def load_ttx_file(filename: str) -> list:
@@ -389,9 +584,45 @@ def extract_alphabet(filename: str, flip_horizontally: Optional[bool] = False,
     the key is the name of the glyph
     the value is a nested list of points
     """
-    ttx.ttDump(filename, "temp.ttx", ttx.Options([], 1))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ttx_filename = os.path.join(temp_dir, "temp.ttx")
+        ttx.ttDump(filename, ttx_filename, ttx.Options([], 1))
+        glyphs = load_ttx_file(ttx_filename)
+    return build_alphabet(glyphs, flip_horizontally, flip_vertically)
+
+
+def extract_alphabet_from_font(font: TTFont, flip_horizontally: Optional[bool] = False,
+                               flip_vertically: Optional[bool] = False) -> Alphabet:
+    """
+    same as extract_alphabet, but for an already loaded (e.g. instanced) font
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ttx_filename = os.path.join(temp_dir, "temp.ttx")
+        font.saveXML(ttx_filename, tables=["glyf"])
+        glyphs = load_ttx_file(ttx_filename)
+    return build_alphabet(glyphs, flip_horizontally, flip_vertically)
+
+
+def round_coordinates(font: TTFont):
+    """
+    instancing leaves float coordinates, they are rounded like they would be when the font is saved
+    """
+    glyf = font["glyf"]
+    for glyph_name in font.getGlyphOrder():
+        glyph = glyf[glyph_name]
+        if glyph.isComposite():
+            for component in glyph.components:
+                component.x, component.y = round(component.x), round(component.y)
+        elif glyph.numberOfContours > 0:
+            glyph.coordinates.toInt()
+    # the bounds of composite glyphs depend on their (now rounded) components
+    for glyph_name in font.getGlyphOrder():
+        glyf[glyph_name].recalcBounds(glyf)
+
+
+def build_alphabet(glyphs: list, flip_horizontally: Optional[bool] = False,
+                   flip_vertically: Optional[bool] = False) -> Alphabet:
     alphabet = Alphabet()
-    glyphs = load_ttx_file("temp.ttx")
 
     for glyph in glyphs:
         try:
@@ -524,31 +755,4 @@ class Sentence:
         return sentence_glyphs
 
     def show(self, filename):
-        svg_code = ""
-        svg_body = ""
-        prev_x = 0
-        prev_y = 1000
-        MAX_X = 10000
-        for glyph in self.sentence_glyphs:
-            glyph.move_to(prev_x, prev_y)
-            for contour in glyph.contours:
-                svg_body += f"""<path d="{contour.text}" fill="{contour.fill}" stroke="{contour.stroke}" transform="{contour.transform}" stroke-width="{contour.stroke_width}"/>\n"""
-            svg_body += f"""<circle cx="{prev_x}" cy="{prev_y}" r="25" fill="none" stroke="red" stroke-width="10" />\n"""
-            prev_x += 1000
-            if prev_x >= MAX_X:
-                prev_x = 0
-                prev_y += 1000
-
-        HEADER = f"""<?xml version="1.0" standalone="no"?>
-    <!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 20010904//EN"
-            "http://www.w3.org/TR/2001/REC-SVG-20010904/DTD/svg10.dtd">
-    <svg version="1.0" xmlns="http://www.w3.org/2000/svg"
-         width="210mm" height="297mm" viewBox="0 0 {MAX_X} {abs(prev_y)}">"""
-
-        FOOTER = "</svg>"
-
-        svg_code += HEADER
-        svg_code += svg_body
-        svg_code += FOOTER
-        with open(filename, 'w') as file:
-            file.write(svg_code)
+        write_glyph_sheet(self.sentence_glyphs, filename, with_names=False)